@@ -0,0 +1,79 @@
+"""Cold indexing time for a directory of FITS headers: opening each file with astropy vs HeaderIndex's header-only reads.
+
+Writes 2,000 small frames with typical capture keywords and times reading
+FILTER, EXPTIME, GAIN etc. from all of them: fits.open (primary HDU
+header and data), fits.getheader, and HeaderIndex.load with 1, 2, 4 and
+16 threads. The page cache is warm after the files are written, so this
+is parsing cost, which holds the GIL: extra threads only pay off while
+waiting on a cold disk or a network share, which is why HEADER_WORKERS is small.
+
+Run from the repository root: python benchmarks/header_index.py [files]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import headerindex
+
+FILE_COUNT = 2000
+FRAME_SHAPE = (256, 256)
+
+
+def make_files(directory, count):
+    data = np.zeros(FRAME_SHAPE, np.uint16)
+    names = []
+    for i in range(count):
+        header = fits.Header()
+        header['DATE-OBS'] = f"2024-03-{1 + i // 500:02d}T{i % 24:02d}:00:00"
+        header['OBJECT'] = 'M106'
+        header['IMAGETYP'] = 'Light Frame'
+        header['FILTER'] = ('L', 'R', 'G', 'B', 'Ha')[i % 5]
+        header['EXPTIME'] = (60.0, 180.0, 300.0)[i % 3]
+        header['GAIN'] = 100
+        header['CCD-TEMP'] = -10.0
+        for j in range(40):  # capture programs write plenty of other keywords
+            header[f'KEY{j}'] = j
+        names.append(f"light_{i:05d}.fits")
+        fits.PrimaryHDU(data, header=header).writeto(os.path.join(directory, names[-1]))
+    return names
+
+
+def keywords_from(header):
+    return {keyword: header[keyword] for keyword in headerindex.HEADER_KEYWORDS if keyword in header}
+
+
+def open_with_data(path):
+    with fits.open(path) as hdul:
+        hdul[0].data
+        return keywords_from(hdul[0].header)
+
+
+def measure(name, count, read):
+    start = time.perf_counter()
+    read()
+    elapsed = time.perf_counter() - start
+    print(f"{name:32s} {elapsed:7.2f} s  {count / elapsed:8.0f} files/s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) == 2 else FILE_COUNT
+    with tempfile.TemporaryDirectory() as directory:
+        names = make_files(directory, count)
+        paths = [os.path.join(directory, name) for name in names]
+        print(f"{count} files of {FRAME_SHAPE[0]}x{FRAME_SHAPE[1]}")
+        measure("fits.open, header and data", count, lambda: [open_with_data(path) for path in paths])
+        measure("fits.getheader", count, lambda: [keywords_from(fits.getheader(path)) for path in paths])
+        for workers in (1, 2, 4, 16):
+            index = headerindex.HeaderIndex(workers=workers)
+            measure(f"HeaderIndex, {workers} threads", count, lambda: asyncio.run(index.load(directory, names)))
+            index.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Button interlock evaluation: re-running every condition each 100ms tick vs the memoized InterlockEngine.
+
+Simulates a night of ticks where the roof/lock state changes rarely (a full
+open/close cycle every 3000 ticks) and counts predicate evaluations and
+enable()/disable() calls alongside the time taken.
+
+Run from the repository root: python benchmarks/interlock_rules.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import interlocks
+from commsmanager import MotionState
+
+TICKS = 100000
+# (roof_state, lock_state) sequence of an unlock/raise/lower/lock cycle, each held for a while
+CYCLE = [
+    (MotionState.LOWERED, MotionState.RAISED),
+    (MotionState.LOWERED, MotionState.LOWERING),
+    (MotionState.LOWERED, MotionState.LOWERED),
+    (MotionState.RAISING, MotionState.LOWERED),
+    (MotionState.RAISED, MotionState.LOWERED),
+    (MotionState.LOWERING, MotionState.LOWERED),
+    (MotionState.LOWERED, MotionState.LOWERED),
+    (MotionState.LOWERED, MotionState.RAISING),
+]
+TICKS_PER_STATE = 3000 // len(CYCLE)
+
+
+class FakeButton:
+    def __init__(self):
+        self.enabled = True
+        self.calls = 0
+
+    def enable(self):
+        self.enabled = True
+        self.calls += 1
+
+    def disable(self):
+        self.enabled = False
+        self.calls += 1
+
+
+def states():
+    for tick in range(TICKS):
+        yield CYCLE[(tick // TICKS_PER_STATE) % len(CYCLE)]
+
+
+def polled():
+    """The old ButtonConditions: every condition of every button, every tick."""
+    inputs = {'control_enabled': True, 'connected': True}
+    buttons = {rule: FakeButton() for rule in interlocks.ROOF_INTERLOCKS}
+    evaluations = 0
+    for roof_state, lock_state in states():
+        inputs['roof_state'] = roof_state
+        inputs['lock_state'] = lock_state
+        for rule, conditions in interlocks.ROOF_INTERLOCKS.items():
+            evaluations += 1
+            enabled = True
+            for names, predicate in conditions:
+                if not predicate(*(inputs[name] for name in names)):
+                    enabled = False
+                    break
+            button = buttons[rule]
+            if enabled and not button.enabled:
+                button.enable()
+            elif not enabled and button.enabled:
+                button.disable()
+    return evaluations, sum(button.calls for button in buttons.values())
+
+
+def memoized():
+    engine = interlocks.InterlockEngine(interlocks.ROOF_INTERLOCKS, control_enabled=True, connected=True, roof_state=None, lock_state=None)
+    buttons = {rule: FakeButton() for rule in interlocks.ROOF_INTERLOCKS}
+    for rule, button in buttons.items():
+        engine.on_change(rule, lambda enabled, button=button: button.enable() if enabled else button.disable())
+    for roof_state, lock_state in states():
+        engine.set_inputs(roof_state=roof_state, lock_state=lock_state)
+    return engine.evaluations, sum(button.calls for button in buttons.values())
+
+
+def main():
+    print(f"{TICKS} ticks, state change every {TICKS_PER_STATE} ticks")
+    for name, run in (("poll every condition", polled), ("InterlockEngine", memoized)):
+        start = time.perf_counter()
+        evaluations, calls = run()
+        elapsed = time.perf_counter() - start
+        print(f"{name:22s} {elapsed * 1e3:8.1f} ms  {elapsed / TICKS * 1e6:6.2f} us/tick  {evaluations:8d} rule evaluations  {calls:6d} enable/disable calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""CPU cost of telemetry polling with 1 to 20 viewers: per-client ui.timers vs the shared DeviceService.
+
+Each viewer has the control panel's telemetry widgets (9 roof labels, the
+connection label, 5 telescope state labels and the button state). The old
+layout gave every viewer its own 100ms timers, including a heartbeat, which
+rewrote every label each tick. The new layout runs one heartbeat and one
+TelemetryDispatcher for the app, which only touches labels whose fields
+changed. Serial I/O is replaced by a fake device producing 20 packets/s.
+
+Run from the repository root: python benchmarks/multi_viewer.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import commsmanager
+import deviceservice
+import telemetrydispatch
+
+DURATION = 2.0
+PACKET_RATE = 20
+VIEWER_COUNTS = (1, 5, 10, 20)
+ROOF_FIELDS = ('voltage_12v', 'h_bridge_current', 'voltage_5v', 'raise_1_sw', 'raise_2_sw', 'lower_1_sw', 'lower_2_sw', 'roof_state', 'lock_state')
+TELESCOPE_OUTPUTS = ('lens_cap', 'flat_light', 'heater_1', 'heater_2', 'heater_3')
+
+
+class FakeLabel:
+    """Stands in for a ui.label, counts the updates that would go over the websocket."""
+    is_deleted = False
+
+    def __init__(self):
+        self.text = ''
+        self.updates = 0
+
+    def set_text(self, text):
+        self.text = text
+        self.updates += 1
+
+
+class FakeManager:
+    def __init__(self, record_type):
+        self.record_type = record_type
+        self.last_data = record_type()
+        self.connected = True
+        self.commands = 0
+
+    def zero_data(self):
+        return self.record_type()
+
+    def send_command(self, command):
+        self.commands += 1
+
+
+async def produce_packets(roof, telescope):
+    # Only the H-bridge current and temperatures change, as when the roof is idle
+    i = 0
+    while True:
+        roof.last_data = commsmanager.RoofTelem(0.01 * (i % 3), 5.0, 12.0, 1, 0, 0, 0, 3, 4)
+        telescope.last_data = commsmanager.TelescopeTelem(20.0 + 0.1 * (i % 5), 0, 0, 19.0, *([2, 2, 0] * 3 + [2] * 6))
+        i += 1
+        await asyncio.sleep(1 / PACKET_RATE)
+
+
+def per_client_timers(viewers, roof, telescope):
+    """The old layout: every viewer polls and rewrites all of its labels every 100ms."""
+    jobs = []
+    for _ in range(viewers):
+        labels = [FakeLabel() for _ in range(len(ROOF_FIELDS) + 1 + len(TELESCOPE_OUTPUTS))]
+
+        def update_telemetry(labels=labels):
+            data = roof.last_data if roof.connected else roof.zero_data()
+            for label, field in zip(labels, ROOF_FIELDS):
+                label.set_text(str(getattr(data, field)))
+            labels[len(ROOF_FIELDS)].set_text("CONNECTED" if roof.connected else "DISCONNECTED")
+
+        jobs.append(update_telemetry)
+        jobs.append(lambda: roof.send_command(commsmanager.RoofCommand.CMD_HEARTBEAT))
+        for label, output in zip(labels[len(ROOF_FIELDS) + 1:], TELESCOPE_OUTPUTS):
+            jobs.append(lambda label=label, output=output: label.set_text(str([getattr(telescope.last_data, f"{output}_{state}_state") for state in ('driver', 'manual', 'real')])))
+        jobs.append(lambda: [roof.last_data.roof_state, roof.last_data.lock_state])
+    return jobs, labels
+
+
+def shared_service(viewers, roof, telescope, dispatcher):
+    for _ in range(viewers):
+        labels = [FakeLabel() for _ in range(len(ROOF_FIELDS) + 1 + len(TELESCOPE_OUTPUTS))]
+        for label, field in zip(labels, ROOF_FIELDS):
+            dispatcher.subscribe("roof", (field, "connected"), lambda value, connected, label=label: label.set_text(str(value)), owner=label)
+        dispatcher.subscribe("roof", ("connected",), lambda connected, label=labels[len(ROOF_FIELDS)]: label.set_text("CONNECTED" if connected else "DISCONNECTED"))
+        for label, output in zip(labels[len(ROOF_FIELDS) + 1:], TELESCOPE_OUTPUTS):
+            fields = tuple(f"{output}_{state}_state" for state in ('driver', 'manual', 'real'))
+            dispatcher.subscribe("telescope", fields, lambda *values, label=label: label.set_text(str(values)), owner=label)
+        dispatcher.subscribe("roof", ("roof_state", "lock_state", "connected"), lambda *_: None)
+    return labels
+
+
+async def run(viewers, shared):
+    roof = FakeManager(commsmanager.RoofTelem)
+    telescope = FakeManager(commsmanager.TelescopeTelem)
+    service = deviceservice.DeviceService()
+    if shared:
+        dispatcher = telemetrydispatch.TelemetryDispatcher()
+        dispatcher.add_source("roof", roof)
+        dispatcher.add_source("telescope", telescope)
+        labels = shared_service(viewers, roof, telescope, dispatcher)
+        service.every(0.1, lambda: roof.send_command(commsmanager.RoofCommand.CMD_HEARTBEAT))
+        service.every(0.1, dispatcher.dispatch)
+    else:
+        jobs, labels = per_client_timers(viewers, roof, telescope)
+        for job in jobs:
+            service.every(0.1, job)
+
+    producer = asyncio.get_running_loop().create_task(produce_packets(roof, telescope))
+    service.start()
+    start_cpu = time.process_time()
+    await asyncio.sleep(DURATION)
+    cpu = time.process_time() - start_cpu
+    await service.stop()
+    producer.cancel()
+    label_updates = sum(label.updates for label in labels) * viewers  # every viewer sees the same traffic
+    return cpu, roof.commands, label_updates
+
+
+async def main():
+    print(f"{DURATION:.0f}s per run, {PACKET_RATE} packets/s")
+    print(f"{'viewers':>7}  {'layout':16s} {'CPU %':>6}  {'heartbeats/s':>12}  {'label updates/s':>15}")
+    for viewers in VIEWER_COUNTS:
+        for shared, name in ((False, "per-client timers"), (True, "shared service")):
+            cpu, commands, updates = await run(viewers, shared)
+            print(f"{viewers:7d}  {name:16s} {cpu / DURATION * 100:6.2f}  {commands / DURATION:12.0f}  {updates / DURATION:15.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
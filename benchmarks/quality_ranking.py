@@ -0,0 +1,81 @@
+"""Time to rank a night's subs by FWHM: measuring every frame vs an indexed query on the QualityIndex.
+
+Writes synthetic 1024x1024 frames with a FWHM that varies from frame to
+frame and ranks them both ways. The indexed query is also timed on a
+table holding 1,000 frames, to show it doesn't depend on frame size.
+
+Run from the repository root: python benchmarks/quality_ranking.py [frames]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fitsreader
+import qualityindex
+import trackingerror
+
+FRAME_COUNT = 40
+FRAME_SHAPE = (1024, 1024)
+STAR_COUNT = 150
+INDEXED_FRAMES = 1000
+QUERY_REPEATS = 20
+
+
+def make_frame(path, sigma, seed):
+    rng = np.random.default_rng(seed)
+    image = rng.normal(1000, 10, FRAME_SHAPE).astype(np.float32)
+    for x, y, flux in zip(rng.uniform(8, FRAME_SHAPE[1] - 8, STAR_COUNT), rng.uniform(8, FRAME_SHAPE[0] - 8, STAR_COUNT), rng.uniform(2000, 20000, STAR_COUNT)):
+        x0, y0 = int(x) - 6, int(y) - 6
+        yy, xx = np.mgrid[y0:y0 + 13, x0:x0 + 13]
+        image[y0:y0 + 13, x0:x0 + 13] += flux / (2 * np.pi * sigma ** 2) * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * sigma ** 2))
+    fits.PrimaryHDU(np.clip(image, 0, 65535).astype(np.uint16)).writeto(path, overwrite=True)
+
+
+def measure_frame(path):
+    """What ranking costs without the index: detect and measure the stars of every frame."""
+    data = fitsreader.read_fits_data(path)
+    median, std = trackingerror.estimate_background(data)
+    x, y, _ = trackingerror.detect_stars(data, median, std)
+    fwhm, _ = trackingerror.star_shapes(data, x, y, std)
+    return float(np.median(fwhm))
+
+
+def main():
+    frame_count = int(sys.argv[1]) if len(sys.argv) == 2 else FRAME_COUNT
+    with tempfile.TemporaryDirectory() as directory:
+        entries = {}
+        for i in range(frame_count):
+            name = f"frame_{i:04d}.fits"
+            make_frame(os.path.join(directory, name), 1.0 + 0.02 * i, i)
+            entries[name] = os.stat(os.path.join(directory, name)).st_mtime
+        print(f"{frame_count} frames of {FRAME_SHAPE[0]}x{FRAME_SHAPE[1]}")
+
+        start = time.perf_counter()
+        fwhms = {name: measure_frame(os.path.join(directory, name)) for name in entries}
+        ranked = sorted(entries, key=fwhms.get)
+        elapsed = time.perf_counter() - start
+        print(f"{'measure every frame':28s} {elapsed * 1000:9.1f} ms  ({elapsed / frame_count * INDEXED_FRAMES:.0f} s for {INDEXED_FRAMES} frames)")
+
+        index = qualityindex.QualityIndex(os.path.join(directory, "quality.sqlite3"))
+        index.store(directory, [(name, entries[name], fwhms[name], 0.1, STAR_COUNT, 1000.0) for name in entries])
+        start = time.perf_counter()
+        for _ in range(QUERY_REPEATS):
+            indexed = [name for name, _ in index.query(directory, entries, 'fwhm')]
+        print(f"{'indexed query':28s} {(time.perf_counter() - start) / QUERY_REPEATS * 1000:9.1f} ms  same order: {indexed == ranked}")
+
+        rng = np.random.default_rng(0)
+        many = {f"sub_{i:04d}.fits": float(i) for i in range(INDEXED_FRAMES)}
+        index.store(directory, [(name, mtime, float(rng.uniform(1.5, 5)), 0.1, STAR_COUNT, 1000.0) for name, mtime in many.items()])
+        start = time.perf_counter()
+        for _ in range(QUERY_REPEATS):
+            index.query(directory, many, 'fwhm', max_fwhm=3.0)
+        print(f"{f'indexed query, {INDEXED_FRAMES} frames':28s} {(time.perf_counter() - start) / QUERY_REPEATS * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Compare the incremental FrameDecoder with the old hex-string rfind scan.
+
+Run from the repository root: python benchmarks/serial_decode.py
+"""
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import commsmanager
+
+PACKET_SIZE = 34  # telescope controller, 3 sync bytes + 31 bytes of telemetry
+POLLS = 20000
+PACKETS_PER_POLL = 3
+
+
+def make_packet(i):
+    payload = struct.pack("ffffBBBBBBBBBBBBBBB", 20.0 + i % 10, 1.0, 2.0, 3.0, *([1] * 15))
+    return commsmanager.sync_pattern + payload
+
+
+def legacy_scan(buffer, packet_size):
+    """The previous get_telemetry logic: latest packet only, buffer never consumed."""
+    buffer = buffer[-commsmanager.MAX_BUFFER_SIZE:]
+    sync_index = int(buffer.hex().rfind("505050") / 2)
+    packet = None
+    if sync_index != -1 and len(buffer) - sync_index >= packet_size:
+        packet = buffer[sync_index:sync_index + packet_size]
+    return buffer, packet
+
+
+def main():
+    chunks = [b"".join(make_packet(poll * PACKETS_PER_POLL + i) for i in range(PACKETS_PER_POLL)) for poll in range(100)]
+
+    buffer = bytearray()
+    legacy_packets = 0
+    start = time.perf_counter()
+    for poll in range(POLLS):
+        buffer += chunks[poll % len(chunks)]
+        buffer, packet = legacy_scan(buffer, PACKET_SIZE)
+        legacy_packets += packet is not None
+    legacy_time = time.perf_counter() - start
+
+    decoder = commsmanager.FrameDecoder(PACKET_SIZE)
+    decoded_packets = 0
+    start = time.perf_counter()
+    for poll in range(POLLS):
+        decoded_packets += len(decoder.feed(chunks[poll % len(chunks)]))
+    decoder_time = time.perf_counter() - start
+
+    sent = POLLS * PACKETS_PER_POLL
+    print(f"{POLLS} polls, {sent} packets sent")
+    print(f"hex rfind:     {legacy_time / POLLS * 1e6:6.2f} us/poll, {legacy_time / legacy_packets * 1e6:6.2f} us/packet, {legacy_packets} packets decoded")
+    print(f"FrameDecoder:  {decoder_time / POLLS * 1e6:6.2f} us/poll, {decoder_time / decoded_packets * 1e6:6.2f} us/packet, {decoded_packets} packets decoded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Wall time of full-frame vs tiled star detection, with tiles spread over 1..N worker threads or processes.
+
+Writes a synthetic 16-bit frame (61MP by default, like a full frame
+IMX455) with a background gradient and Gaussian stars, then times
+trackingerror.find_stars on it. Pass rows and columns to use another size.
+
+Run from the repository root: python benchmarks/star_detection.py [rows columns]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import trackingerror
+
+FRAME_SHAPE = (6388, 9576)
+STARS_PER_MEGAPIXEL = 60
+STAR_SIGMA = 1.3
+
+
+def make_frame(path, shape, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.normal(1000, 10, shape).astype(np.float32)
+    image += np.linspace(0, 50, shape[1], dtype=np.float32)[None, :]
+    count = int(shape[0] * shape[1] / 1e6 * STARS_PER_MEGAPIXEL)
+    xs = rng.uniform(8, shape[1] - 8, count)
+    ys = rng.uniform(8, shape[0] - 8, count)
+    for x, y, flux in zip(xs, ys, rng.uniform(500, 5000, count)):
+        x0, y0 = int(x) - 6, int(y) - 6
+        yy, xx = np.mgrid[y0:y0 + 13, x0:x0 + 13]
+        image[y0:y0 + 13, x0:x0 + 13] += flux / (2 * np.pi * STAR_SIGMA ** 2) * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * STAR_SIGMA ** 2))
+    hdu = fits.PrimaryHDU(np.clip(image, 0, 65535).astype(np.uint16))
+    hdu.writeto(path, overwrite=True)
+
+
+def measure(name, find):
+    start = time.perf_counter()
+    x, _ = find()
+    print(f"{name:28s} {time.perf_counter() - start:7.2f} s  {x.size:6d} stars")
+
+
+def main():
+    shape = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) == 3 else FRAME_SHAPE
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, cores} & set(range(1, cores + 1)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "frame.fits")
+        make_frame(path, shape)
+        print(f"{shape[0]}x{shape[1]} frame ({shape[0] * shape[1] / 1e6:.0f}MP), {cores} cores")
+        measure("full frame", lambda: trackingerror.find_stars(path))
+        for workers in worker_counts:
+            measure(f"tiled, {workers} threads", lambda: trackingerror.find_stars(path, tiled=True, workers=workers))
+        for workers in worker_counts:
+            measure(f"tiled, {workers} processes", lambda: trackingerror.find_stars(path, tiled=True, workers=workers, use_processes=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Decode time and allocations per 10k telescope packets: old dataclass records vs PacketRecord.
+
+Run from the repository root: python benchmarks/telemetry_decode.py
+"""
+import os
+import struct
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import commsmanager
+import telemetryhistory
+from commsmanager import MotionState
+
+PACKETS = 10000
+
+
+@dataclass
+class LegacyRoofTelem:
+    h_bridge_current: float = 0
+    voltage_5v: float = 0
+    voltage_12v: float = 0
+    raise_1_sw: bool = 0
+    raise_2_sw: bool = False
+    lower_1_sw: bool = False
+    lower_2_sw: bool = False
+    roof_state: MotionState = MotionState.UNKNOWN
+    lock_state: MotionState = MotionState.UNKNOWN
+
+
+def legacy_decode(payloads):
+    records = []
+    for payload in payloads:
+        record = LegacyRoofTelem(*struct.unpack("fffBBBBBB", payload))
+        record.roof_state = MotionState(record.roof_state)
+        record.lock_state = MotionState(record.lock_state)
+        records.append(record)
+    return records
+
+
+def record_decode(payloads):
+    return [commsmanager.RoofTelem.unpack(payload) for payload in payloads]
+
+
+def history_decode(payloads):
+    history = telemetryhistory.TelemetryHistory(commsmanager.RoofTelem.STRUCT_FORMAT, commsmanager.RoofTelem.NAMES, capacity=PACKETS)
+    history.append_packets(time.time(), payloads)
+    return history
+
+
+def measure(name, decode, payloads):
+    start = time.perf_counter()
+    decode(payloads)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = decode(payloads)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    print(f"{name:28s} {elapsed * 1e3:7.2f} ms  {current / 1024:8.1f} KiB retained")
+
+
+def main():
+    payloads = [struct.pack("fffBBBBBB", 0.1 * (i % 50), 5.0, 12.0, 1, 0, 0, 0, i % 5, 4) for i in range(PACKETS)]
+    print(f"{PACKETS} roof packets")
+    measure("dataclass + enums", legacy_decode, payloads)
+    measure("PacketRecord (lazy enums)", record_decode, payloads)
+    measure("TelemetryHistory batch", history_decode, payloads)
+
+
+if __name__ == "__main__":
+    main()
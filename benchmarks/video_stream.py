@@ -0,0 +1,123 @@
+"""CPU cost of serving camera frames to 1-20 viewers through VideoManager: encode per request vs shared encodes.
+
+A synthetic 1280x720 camera publishes frames at 15 fps into a real
+VideoManager with its RTSP capture thread never started. Viewers either:
+- poll at 10Hz and JPEG encode the latest frame on every request (what
+  /video/frame did before the shared encode),
+- poll at 10Hz through VideoManager.grab_video_frame (encodes at most
+  once per frame), or
+- read the MJPEG stream from VideoManager.stream_frames.
+Encodes are counted by wrapping VideoManager.convert.
+
+Needs the panel's requirements (opencv-python, nicegui, ...).
+Run from the repository root: python benchmarks/video_stream.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import videomanager
+
+DURATION = 2.0
+CAMERA_FPS = 15
+POLL_RATE = 10
+VIEWER_COUNTS = (1, 5, 10, 20)
+
+encodes = 0
+encode = videomanager.VideoManager.convert
+
+
+def counting_convert(frame):
+    global encodes
+    encodes += 1
+    return encode(frame)
+
+
+videomanager.VideoManager.convert = counting_convert
+
+
+def make_frames(count=CAMERA_FPS):
+    rng = np.random.default_rng(0)
+    base = np.linspace(0, 255, 1280, dtype=np.float32)[None, :, None].repeat(720, axis=0).repeat(3, axis=2)
+    return [np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8) for _ in range(count)]
+
+
+def make_manager(directory):
+    credential_file = os.path.join(directory, "camera.yaml")
+    with open(credential_file, "w") as file:
+        file.write("username: user\npassword: password\nip: 127.0.0.1\n")
+    return videomanager.VideoManager(credential_file)
+
+
+def camera(manager, frames, stop):
+    """Stands in for the capture thread, publishing a frame every 1 / CAMERA_FPS seconds."""
+    i = 0
+    while not stop.is_set():
+        manager.publish(frames[i % len(frames)])
+        i += 1
+        stop.wait(1 / CAMERA_FPS)
+
+
+async def encoding_viewer(manager, received):
+    while True:
+        frame = manager.latest_frame
+        if frame is not None:
+            jpeg = await asyncio.to_thread(videomanager.VideoManager.convert, frame)
+            received.append(len(jpeg))
+        await asyncio.sleep(1 / POLL_RATE)
+
+
+async def snapshot_viewer(manager, received):
+    while True:
+        response = await manager.grab_video_frame()
+        received.append(len(response.body))
+        await asyncio.sleep(1 / POLL_RATE)
+
+
+async def streaming_viewer(manager, received):
+    async for part in manager.stream_frames():
+        received.append(len(part))
+
+
+async def run(viewers, viewer, frames, directory):
+    global encodes
+    manager = make_manager(directory)
+    received = []
+    stop = threading.Event()
+    capture = threading.Thread(target=camera, args=(manager, frames, stop), daemon=True)
+    tasks = [asyncio.create_task(viewer(manager, received)) for _ in range(viewers)]
+    encodes = 0
+    start_cpu = time.process_time()
+    capture.start()
+    await asyncio.sleep(DURATION)
+    cpu = time.process_time() - start_cpu
+    stop.set()
+    capture.join()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return cpu, encodes, len(received), manager.frames_decoded
+
+
+async def main():
+    frames = make_frames()
+    modes = ((encoding_viewer, f"encode per request {POLL_RATE}Hz"),
+             (snapshot_viewer, f"grab_video_frame {POLL_RATE}Hz"),
+             (streaming_viewer, "stream_frames MJPEG"))
+    print(f"1280x720 camera at {CAMERA_FPS} fps, {DURATION:.0f}s per run")
+    print(f"{'viewers':>7}  {'mode':26s} {'CPU %':>6}  {'encodes/frame':>13}  {'frames delivered/s':>18}")
+    with tempfile.TemporaryDirectory() as directory:
+        for viewers in VIEWER_COUNTS:
+            for viewer, name in modes:
+                cpu, encoded, delivered, published = await run(viewers, viewer, frames, directory)
+                print(f"{viewers:7d}  {name:26s} {cpu / DURATION * 100:6.1f}  {encoded / max(published, 1):13.2f}  {delivered / DURATION:18.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,15 +1,21 @@
 import serial
 import struct
-from dataclasses import dataclass
 from enum import Enum
 import traceback
-
-sent = False
-data_buffer = bytearray()
+import asyncio
+import queue
+import time
+from threading import Thread, Event
+import telemetryhistory
 
 MAX_BUFFER_SIZE = 1024
+# Seconds a read waits for data, also bounds how long stop() takes
+READ_TIMEOUT = 0.1
+# Reconnect backoff when a device is missing, in seconds
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10
 # Sync pattern to look for
-sync_pattern = "505050"
+sync_pattern = b"\x50\x50\x50"
 
 class MotionState(Enum):
     UNKNOWN = 0
@@ -48,120 +54,317 @@ class TelescopeCommand(Enum):
     LIGHT_ON = 0x09
     LIGHT_OFF = 0x0A
 
-@dataclass
-class RoofTelem:
-    h_bridge_current: float = 0
-    voltage_5v: float = 0
-    voltage_12v: float = 0
-    raise_1_sw: bool = 0
-    raise_2_sw: bool = False
-    lower_1_sw: bool = False
-    lower_2_sw: bool = False
-    roof_state: MotionState = MotionState.UNKNOWN
-    lock_state: MotionState = MotionState.UNKNOWN
-
-@dataclass
-class TelescopeTelem:
-    temp_1: float = 0
-    temp_2: float = 0
-    temp_3: float = 0
-    temp_ref: float = 0
-    heater_1_driver_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    heater_1_manual_state:  GenericControllerState = GenericControllerState.STATE_UNDEF
-    heater_1_real_state: HeaterState = HeaterState.STATE_OFF
-    heater_2_driver_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    heater_2_manual_state:  GenericControllerState = GenericControllerState.STATE_UNDEF
-    heater_2_real_state: HeaterState = HeaterState.STATE_OFF
-    heater_3_driver_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    heater_3_manual_state:  GenericControllerState = GenericControllerState.STATE_UNDEF
-    heater_3_real_state: HeaterState = HeaterState.STATE_OFF
-    flat_light_driver_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    flat_light_manual_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    flat_light_real_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    lens_cap_driver_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    lens_cap_manual_state: GenericControllerState = GenericControllerState.STATE_UNDEF
-    lens_cap_real_state: GenericControllerState = GenericControllerState.STATE_UNDEF
+class PacketRecord:
+    """Telemetry decoded from one packet, stored as the tuple struct.unpack returns.
+
+    Subclasses list their FIELDS as (name, default) pairs in packet order and
+    get a read-only attribute per field. Fields in ENUMS are kept as raw numbers
+    and only turned into enum members when read.
+    """
+    __slots__ = ('values',)
+    STRUCT_FORMAT = ''
+    FIELDS = ()
+    ENUMS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.PACKET = struct.Struct(cls.STRUCT_FORMAT)
+        cls.NAMES = tuple(name for name, _ in cls.FIELDS)
+        for index, name in enumerate(cls.NAMES):
+            setattr(cls, name, cls.field_property(index, cls.ENUMS.get(name)))
+
+    @staticmethod
+    def field_property(index, enum_type):
+        if enum_type is None:
+            return property(lambda self: self.values[index])
+        return property(lambda self: enum_type(self.values[index]))
+
+    def __init__(self, *values):
+        values = list(values) + [default for _, default in self.FIELDS[len(values):]]
+        self.values = tuple(value.value if isinstance(value, Enum) else value for value in values)
+
+    @classmethod
+    def unpack(cls, payload):
+        """Decode one packet payload (sync pattern stripped) with the precompiled struct."""
+        record = cls.__new__(cls)
+        record.values = cls.PACKET.unpack(payload)
+        return record
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values == other.values
+
+    def __repr__(self):
+        fields_text = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.NAMES)
+        return f"{type(self).__name__}({fields_text})"
+
+class RoofTelem(PacketRecord):
+    __slots__ = ()
+    STRUCT_FORMAT = "fffBBBBBB"
+    FIELDS = (
+        ('h_bridge_current', 0),
+        ('voltage_5v', 0),
+        ('voltage_12v', 0),
+        ('raise_1_sw', 0),
+        ('raise_2_sw', False),
+        ('lower_1_sw', False),
+        ('lower_2_sw', False),
+        ('roof_state', MotionState.UNKNOWN),
+        ('lock_state', MotionState.UNKNOWN),
+    )
+    ENUMS = {'roof_state': MotionState, 'lock_state': MotionState}
+
+class TelescopeTelem(PacketRecord):
+    __slots__ = ()
+    STRUCT_FORMAT = "ffffBBBBBBBBBBBBBBB"
+    FIELDS = (
+        ('temp_1', 0),
+        ('temp_2', 0),
+        ('temp_3', 0),
+        ('temp_ref', 0),
+        ('heater_1_driver_state', GenericControllerState.STATE_UNDEF),
+        ('heater_1_manual_state', GenericControllerState.STATE_UNDEF),
+        ('heater_1_real_state', HeaterState.STATE_OFF),
+        ('heater_2_driver_state', GenericControllerState.STATE_UNDEF),
+        ('heater_2_manual_state', GenericControllerState.STATE_UNDEF),
+        ('heater_2_real_state', HeaterState.STATE_OFF),
+        ('heater_3_driver_state', GenericControllerState.STATE_UNDEF),
+        ('heater_3_manual_state', GenericControllerState.STATE_UNDEF),
+        ('heater_3_real_state', HeaterState.STATE_OFF),
+        ('flat_light_driver_state', GenericControllerState.STATE_UNDEF),
+        ('flat_light_manual_state', GenericControllerState.STATE_UNDEF),
+        ('flat_light_real_state', GenericControllerState.STATE_UNDEF),
+        ('lens_cap_driver_state', GenericControllerState.STATE_UNDEF),
+        ('lens_cap_manual_state', GenericControllerState.STATE_UNDEF),
+        ('lens_cap_real_state', GenericControllerState.STATE_UNDEF),
+    )
+    ENUMS = {
+        'heater_1_driver_state': GenericControllerState,
+        'heater_1_manual_state': GenericControllerState,
+        'heater_1_real_state': HeaterState,
+        'heater_2_driver_state': GenericControllerState,
+        'heater_2_manual_state': GenericControllerState,
+        'heater_2_real_state': HeaterState,
+        'heater_3_driver_state': GenericControllerState,
+        'heater_3_manual_state': GenericControllerState,
+        'heater_3_real_state': HeaterState,
+        'flat_light_driver_state': GenericControllerState,
+        'flat_light_manual_state': GenericControllerState,
+        'flat_light_real_state': GenericControllerState,
+        'lens_cap_driver_state': GenericControllerState,
+        'lens_cap_manual_state': GenericControllerState,
+        'lens_cap_real_state': GenericControllerState,
+    }
+
+class FrameDecoder:
+    """Incremental decoder for fixed-size packets that start with the sync pattern.
+
+    Bytes are fed in as they arrive and every complete packet is returned
+    exactly once. Only newly received bytes are searched, consumed packets are
+    dropped from the buffer, and an optional checksum(packet) -> bool rejects
+    false syncs inside payload data.
+    """
+
+    def __init__(self, packet_size_bytes, checksum=None, max_buffer_size=MAX_BUFFER_SIZE):
+        self.packet_size_bytes = packet_size_bytes
+        self.checksum = checksum
+        self.max_buffer_size = max_buffer_size
+        self.buffer = bytearray()
+        self.dropped_bytes = 0
+
+    def feed(self, data):
+        """Add received bytes and return the payloads (sync pattern stripped) of all packets completed by them."""
+        self.buffer += data
+        payloads = []
+        position = 0
+        while True:
+            start = self.buffer.find(sync_pattern, position)
+            if start == -1:
+                # Keep a partial sync pattern at the end for the next call
+                position = max(position, len(self.buffer) - len(sync_pattern) + 1)
+                break
+            if len(self.buffer) - start < self.packet_size_bytes:
+                position = start
+                break
+            if self.checksum is not None and not self.checksum(bytes(self.buffer[start:start + self.packet_size_bytes])):
+                position = start + 1
+                continue
+            payloads.append(bytes(self.buffer[start + len(sync_pattern):start + self.packet_size_bytes]))
+            position = start + self.packet_size_bytes
+
+        del self.buffer[:position]
+        if len(self.buffer) > self.max_buffer_size:
+            self.dropped_bytes += len(self.buffer) - self.max_buffer_size
+            del self.buffer[:-self.max_buffer_size]
+        return payloads
+
+    def reset(self):
+        self.buffer.clear()
+
 
 class SerialManager:
-    def __init__(self, device_path, packet_size_bytes):
+    """Owns a serial device: a background thread keeps it connected, decodes every packet and publishes the latest telemetry.
+
+    last_data is replaced (never mutated) for each packet, so readers on other
+    threads can use it without locking. subscribe() hands out a queue that
+    receives every packet.
+    """
+
+    def __init__(self, device_path, packet_size_bytes, checksum=None):
         self.device_path = device_path
-        self.data_buffer = bytearray()
+        self.decoder = FrameDecoder(packet_size_bytes, checksum)
         self.packet_size_bytes = packet_size_bytes
         self.port = None
         self.connected = False
+        self.subscribers = []
+        self.history = None  # TelemetryHistory of every packet, set up by subclasses
+        self.loop = None
+        self.reader = None
+        self.stopping = Event()  # set by stop(), also wakes the reconnect backoff
 
-    def send_command(self, command):
-        if self.port is None or self.connected == False:
+    def start(self):
+        """Start the reader thread. If called on an event loop, state callbacks are delivered on that loop."""
+        if self.reader is not None:
+            return
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+        self.stopping.clear()
+        self.reader = Thread(target=self.read_loop, daemon=True, name=f"serial reader {self.device_path}")
+        self.reader.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.reader is not None:
+            # The reader notices within one READ_TIMEOUT read, or at once if it is backing off
+            self.reader.join()
+            self.reader = None
+        self.close_port()
+
+    def subscribe(self, maxsize=1000):
+        """Return a queue that receives every decoded packet, the oldest are dropped if it isn't drained."""
+        subscriber = queue.Queue(maxsize=maxsize)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def open_port(self):
+        self.port = serial.Serial(self.device_path, baudrate=57600, timeout=READ_TIMEOUT)
+        self.decoder.reset()
+        self.connected = True
+
+    def close_port(self):
+        self.connected = False
+        port, self.port = self.port, None
+        if port is not None:
+            try:
+                port.close()
+            except Exception:
+                pass
+
+    def read_loop(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self.stopping.is_set():
+            if not self.connected:
+                try:
+                    self.open_port()
+                    delay = RECONNECT_MIN_DELAY
+                except Exception:
+                    # Device missing, back off before trying again
+                    self.stopping.wait(delay)
+                    delay = min(2 * delay, RECONNECT_MAX_DELAY)
+                    continue
+            try:
+                # Blocks for at most READ_TIMEOUT waiting for the first byte
+                data = self.port.read(max(1, self.port.in_waiting))
+            except Exception as e:
+                print(f"unable to read from serial port with error {e}")
+                self.close_port()
+                continue
             try:
-                self.port = serial.Serial(self.device_path, baudrate=57600, timeout=5)
-                self.connected = True
-                #set_roof_connected(True)
+                # Parse every complete packet (excluding the sync pattern) in the order received
+                payloads = self.decoder.feed(data)
+                if self.history is not None and payloads:
+                    self.history.append_packets(time.time(), payloads)
             except Exception as e:
+                # Reconnecting resets the decoder and resynchronizes on the next sync pattern
+                print(f"unable to decode serial data with error {e}")
+                self.close_port()
+                continue
+            for payload in payloads:
+                try:
+                    telemetry = self.parse_data(payload)
+                except Exception as e:
+                    # A corrupted packet (e.g. an out of range state byte) is dropped, the next one replaces it
+                    print(f"dropping bad packet from {self.device_path} with error {e}")
+                    continue
+                self.publish(telemetry)
+
+    def publish(self, telemetry):
+        self.last_data = telemetry
+        for subscriber in list(self.subscribers):
+            try:
+                if subscriber.full():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(telemetry)
+            except (queue.Empty, queue.Full):
                 pass
-                #print(f"unable to open serial port with error {e}")
-                #set_roof_connected(False
+
+    def run_callbacks(self, callbacks):
+        """Run state change callbacks on the event loop the reader was started from."""
+        if not callbacks:
+            return
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(lambda: [callback() for callback in callbacks])
         else:
-            data = bytearray([0x50,0x50,0x50]) + bytearray([command.value])
-            self.port.write(data)
+            for callback in callbacks:
+                callback()
+
+    def send_command(self, command):
+        """Write a command to the device, return whether it was sent."""
+        port = self.port
+        if port is None or self.connected == False:
+            # The reader thread reconnects, commands sent while disconnected are dropped
+            print(f"not connected to {self.device_path}, dropping command {command.name}")
+            return False
+        data = bytearray(sync_pattern) + bytearray([command.value])
+        try:
+            port.write(data)
+        except Exception as e:
+            print(f"unable to write to serial port with error {e}")
+            return False
+        return True
 
     def get_telemetry(self):
+        """Latest decoded telemetry, kept current by the reader thread."""
         if self.port is None or self.connected == False:
-            try:
-                self.port = serial.Serial(self.device_path, baudrate=57600, timeout=5)
-                self.connected = True
-                #set_roof_connected(True)
-            except Exception as e:
-                pass
-                #print(f"unable to open serial port with error {e}")
-                #set_roof_connected(False)
             return self.zero_data()
-        else:       
-            try:
-                # Read all available bytes from the serial port
-                if self.port.in_waiting > 0:
-                    data = self.port.read(self.port.in_waiting)
-                    self.data_buffer += data
-                    if len(self.data_buffer) > MAX_BUFFER_SIZE:
-                        # Optionally, log a  warning here
-                        self.data_buffer = self.data_buffer[-MAX_BUFFER_SIZE:]  # Keep the last MAX_BUFFER_SIZE bytes
-                        #print("max size exceeded!")
-                    # Look for the sync pattern in the buffer
-                    sync_index = int(self.data_buffer.hex().rfind(sync_pattern) / 2)
-                    if sync_index != -1:
-                        # Check if there are at least 10 bytes following the sync pattern
-                        if len(self.data_buffer) - sync_index >= self.packet_size_bytes:  # 3 bytes of sync pattern + 10 bytes of data
-                            # Extract and remove the 13 bytes (sync pattern + data) from the buffer
-                            packet = self.data_buffer[sync_index:sync_index+self.packet_size_bytes]
-                            data_buffer = self.data_buffer[sync_index+self.packet_size_bytes:]
-
-                            # Parse the data (excluding the sync pattern)
-                            self.last_data =  self.parse_data(packet[3:])         
-                            return self.last_data   
-            except Exception as e:
-                print(f"unable to read from serial port with error {e}")
-                self.connected = False
-                return self.zero_data()
-             
-                #data = [0 for i in range(NUM_TELEM_ELEMENTS)]
-                #set_roof_connected(False)
-            return self.last_data
+        return self.last_data
 
 class TelescopeCommManager(SerialManager):
     def __init__(self, device_path):
         super().__init__(device_path, 34)
         self.last_data = TelescopeTelem()
+        self.history = telemetryhistory.TelemetryHistory(TelescopeTelem.STRUCT_FORMAT, TelescopeTelem.NAMES)
     
     def parse_data(self, packet: bytearray):
         if len(packet) != self.packet_size_bytes-3:
             print(f"Error! invalid packet size {len(packet)}")
-        struct_format = "ffffBBBBBBBBBBBBBBB"
-        deserialized_data = TelescopeTelem(*struct.unpack(struct_format, packet))
+        deserialized_data = TelescopeTelem.unpack(packet)
         return deserialized_data
 
+    def zero_data(self):
+        return TelescopeTelem()
+
 class RoofCommManager(SerialManager):  
     def __init__(self, device_path):
         super().__init__(device_path, 21)
         self.last_data = RoofTelem()
+        self.history = telemetryhistory.TelemetryHistory(RoofTelem.STRUCT_FORMAT, RoofTelem.NAMES)
+        self.motion_started = None  # time of the last raise/lower command
         self.on_raised_callbacks = []
         self.on_lowered_callbacks = []
         self.on_locked_callbacks = []
@@ -171,22 +374,15 @@ class RoofCommManager(SerialManager):
     def parse_data(self, packet: bytearray):
         if len(packet) != self.packet_size_bytes-3:
             print(f"Error! invalid packet size {len(packet)}")
-        struct_format = "fffBBBBBB"
-        deserialized_data = RoofTelem(*struct.unpack(struct_format, packet))
-        deserialized_data.roof_state = MotionState(deserialized_data.roof_state)
-        deserialized_data.lock_state = MotionState(deserialized_data.lock_state)
+        deserialized_data = RoofTelem.unpack(packet)
         if deserialized_data.roof_state == MotionState.RAISED and deserialized_data.roof_state != self.last_data.roof_state:
-            for callback in self.on_raised_callbacks:
-                callback()
+            self.run_callbacks(self.on_raised_callbacks)
         if deserialized_data.roof_state == MotionState.LOWERED and deserialized_data.roof_state != self.last_data.roof_state:
-            for callback in self.on_lowered_callbacks:
-                callback()
+            self.run_callbacks(self.on_lowered_callbacks)
         if deserialized_data.lock_state == MotionState.RAISED and deserialized_data.lock_state != self.last_data.lock_state:
-            for callback in self.on_locked_callbacks:
-                callback()
+            self.run_callbacks(self.on_locked_callbacks)
         if deserialized_data.lock_state == MotionState.LOWERED and deserialized_data.lock_state != self.last_data.lock_state:
-            for callback in self.on_unlocked_callbacks:
-                callback()
+            self.run_callbacks(self.on_unlocked_callbacks)
 
         self.last_data = deserialized_data
         return deserialized_data
@@ -205,31 +401,40 @@ class RoofCommManager(SerialManager):
 
     def raise_roof(self):
         print("Enabling roof raise")
-        self.send_command(RoofCommand.CMD_RAISE_ROOF)
+        self.motion_started = time.time()
+        return self.send_command(RoofCommand.CMD_RAISE_ROOF)
 
     def lower_roof(self):
         print("Enabling roof lower")
-        self.send_command(RoofCommand.CMD_LOWER_ROOF)
+        self.motion_started = time.time()
+        return self.send_command(RoofCommand.CMD_LOWER_ROOF)
+
+    def motion_history(self):
+        """Every packet since the last raise/lower command (or everything recorded if the roof hasn't moved)."""
+        if self.motion_started is None:
+            return self.history.latest()
+        return self.history.since(self.motion_started)
 
     def stop_roof(self):
         #print("Stopping roof")
-        self.send_command(RoofCommand.CMD_STOP_ROOF)
+        return self.send_command(RoofCommand.CMD_STOP_ROOF)
 
     def engage_lock(self):
         print("Engaging Lock")
-        self.send_command(RoofCommand.CMD_ENGAGE_LOCK)
+        return self.send_command(RoofCommand.CMD_ENGAGE_LOCK)
 
     def disengage_lock(self):
         print("Disengaging Lock")
-        self.send_command(RoofCommand.CMD_DISENGAGE_LOCK)
+        return self.send_command(RoofCommand.CMD_DISENGAGE_LOCK)
 
     def stop_lock(self):
         print("Stopping Lock")
-        self.send_command(RoofCommand.STOP_LOCK)
+        return self.send_command(RoofCommand.STOP_LOCK)
 
     def update(self):
-        pass
-        self.send_command(RoofCommand.CMD_HEARTBEAT)
+        # Heartbeats are only worth sending (and reporting as dropped) while connected
+        if self.connected:
+            self.send_command(RoofCommand.CMD_HEARTBEAT)
 
     def zero_data(self):
        return RoofTelem()
\ No newline at end of file
@@ -1,4 +1,5 @@
 from nicegui import Client, app, core, run, ui
+import os
 import time
 from fastapi import Response
 import base64
@@ -9,9 +10,16 @@ from fastapi_utils.tasks import repeat_every
 import struct
 #import videomanager
 import commsmanager
+import telemetrystore
+import telemetrydispatch
+import deviceservice
+import interlocks
 from dataclasses import dataclass
 import capturemanager
 import customui
+import driftmonitor
+import qualityindex
+import headerindex
 import plotly.graph_objs as go
 import asyncio
 
@@ -54,23 +62,16 @@ class ToggleButton(ui.button):
         super().disable()
 
 class ButtonConditions():
+    """Enables/disables a button from its interlock result (see interlocks.ROOF_INTERLOCKS)."""
     def __init__(self, button: ui.button):
         self.button = button
-        self.conditions = []
-
-    def add_condition(self, condition):
-        self.conditions.append(condition)
-
-    def set_enabled(self):
-        found = False
-        for condition in self.conditions:
-            if not condition():
-                found = True
-                if self.button.enabled:
-                    self.button.disable()
-                break
-        if not found and not self.button.enabled:
+
+    def set_enabled(self, enabled):
+        if enabled and not self.button.enabled:
             self.button.enable()
+        elif not enabled and self.button.enabled:
+            self.button.disable()
+
 @dataclass
 class RoofTelemUI:
     h_bridge_current_label: ui.label = ui.label('')
@@ -92,21 +93,24 @@ class RoofControlUI:
     engage_lock_btn: ButtonConditions
     stop_lock_btn: ButtonConditions
     disengage_lock_btn: ButtonConditions
+    interlocks: interlocks.InterlockEngine = None
 
 def reset_roof_motion(roof_ui: RoofControlUI):
     roof_ui.raise_roof_btn.button.turn_off()
     roof_ui.lower_roof_btn.button.turn_off()
     roof_manager.send_command(commsmanager.RoofCommand.CMD_STOP_ROOF)
 
-def set_roof_buttons_state(roof_ui: RoofControlUI):
+def on_roof_control_switched(roof_ui: RoofControlUI):
+    reset_roof_motion(roof_ui)
     if not roof_manager.connected:
         stop_roof(roof_ui)
-    roof_ui.raise_roof_btn.set_enabled()
-    roof_ui.stop_roof_btn.set_enabled()
-    roof_ui.lower_roof_btn.set_enabled()
-    roof_ui.engage_lock_btn.set_enabled()
-    roof_ui.stop_lock_btn.set_enabled()
-    roof_ui.disengage_lock_btn.set_enabled()
+    roof_ui.interlocks.set_inputs(control_enabled=roof_ui.enable_roof_control_sw.value)
+
+def set_roof_buttons_state(roof_ui: RoofControlUI, roof_state, lock_state, connected):
+    if not connected:
+        stop_roof(roof_ui)
+    # Only buttons whose interlock result flips are enabled/disabled
+    roof_ui.interlocks.set_inputs(roof_state=commsmanager.MotionState(roof_state), lock_state=commsmanager.MotionState(lock_state), connected=connected)
     
 def update_latest_photo(recent_image: ui.image):
     changed = capturemanager.convert_fits_to_png()
@@ -128,6 +132,12 @@ def update_latest_photo(recent_image: ui.image):
 #         roof_manager.send_command(commsmanager.RoofCommand.CMD_STOP_ROOF)
 #         roof_ui.enable_roof_control_sw.value = False
 
+def start_roof_command(button: ToggleButton, command):
+    # The controller can drop off between enabling the buttons and a click, don't leave the button looking active
+    if not command():
+        button.turn_off()
+        ui.notify('Roof controller not connected, command not sent', type='warning')
+
 def stop_roof(roof_ui: RoofControlUI):
     roof_ui.raise_roof_btn.button.turn_off()
     roof_ui.lower_roof_btn.button.turn_off()
@@ -140,25 +150,59 @@ def stop_lock(roof_ui: RoofControlUI):
     roof_manager.stop_lock()
     disable_roof_control()
 
-def update_telemetry(ui: RoofTelemUI):
-    telescope_manager.get_telemetry()
-    last_telemetry = roof_manager.get_telemetry()
-    ui.voltage_12v_label.text = format_voltage(last_telemetry.voltage_12v)
-    ui.h_bridge_current_label.text = format_current(last_telemetry.h_bridge_current)
-    ui.voltage_5v_label.text = format_voltage(last_telemetry.voltage_5v)
-    ui.raise_1_sw_label.text = format_limit_sw(last_telemetry.raise_1_sw)
-    ui.raise_2_sw_label.text = format_limit_sw(last_telemetry.raise_2_sw)
-    ui.lower_1_sw_label.text = format_limit_sw(last_telemetry.lower_1_sw)
-    ui.lower_2_sw_label.text = format_limit_sw(last_telemetry.lower_2_sw)
-    ui.roof_position_label.text = format_motion_state(last_telemetry.roof_state)
-    ui.lock_position_label.text = format_motion_state(last_telemetry.lock_state)
-    set_roof_connected(roof_manager.connected)
+def bind_roof_label(label: ui.label, field, formatter):
+    # The formatters show ??? while disconnected, so refresh on connection changes too
+    telemetry_dispatcher.subscribe("roof", (field, "connected"), lambda value, connected: label.set_text(formatter(value)), owner=label)
+
+def subscribe_telemetry(ui: RoofTelemUI, connected_label: ui.label):
+    bind_roof_label(ui.voltage_12v_label, "voltage_12v", format_voltage)
+    bind_roof_label(ui.h_bridge_current_label, "h_bridge_current", format_current)
+    bind_roof_label(ui.voltage_5v_label, "voltage_5v", format_voltage)
+    bind_roof_label(ui.raise_1_sw_label, "raise_1_sw", format_limit_sw)
+    bind_roof_label(ui.raise_2_sw_label, "raise_2_sw", format_limit_sw)
+    bind_roof_label(ui.lower_1_sw_label, "lower_1_sw", format_limit_sw)
+    bind_roof_label(ui.lower_2_sw_label, "lower_2_sw", format_limit_sw)
+    bind_roof_label(ui.roof_position_label, "roof_state", format_motion_state)
+    bind_roof_label(ui.lock_position_label, "lock_state", format_motion_state)
+    telemetry_dispatcher.subscribe("roof", ("connected",), set_roof_connected, owner=connected_label)
+
+def bind_state_label(label, prefix):
+    """Feed a HeaterStateLabel/LensCapStateLabel/FlatLightLabel the driver, manual and real state fields of one telescope output."""
+    fields = (f"{prefix}_driver_state", f"{prefix}_manual_state", f"{prefix}_real_state")
+    telemetry_dispatcher.subscribe("telescope", fields, label.update_text, owner=label)
 
 def disable_roof_control():
     web_ui.roof_control_ui.enable_roof_control_sw.value = False
 
 roof_manager = commsmanager.RoofCommManager("/dev/tty.usbmodem142201")
 telescope_manager = commsmanager.TelescopeCommManager("/dev/tty.usbserial-B0004EQV")
+# Serial readers run in their own threads, started once the event loop is up
+app.on_startup(roof_manager.start)
+app.on_startup(telescope_manager.start)
+app.on_shutdown(roof_manager.stop)
+app.on_shutdown(telescope_manager.stop)
+# Every packet from both controllers is persisted with 1s/1min/1h rollups
+telemetry_store = telemetrystore.TelemetryStore()
+telemetry_store.add_channel("roof", roof_manager.history)
+telemetry_store.add_channel("telescope", telescope_manager.history)
+app.on_startup(telemetry_store.start)
+app.on_shutdown(telemetry_store.stop)
+# One loop diffs the latest telemetry and only updates widgets whose fields changed
+telemetry_dispatcher = telemetrydispatch.TelemetryDispatcher()
+telemetry_dispatcher.add_source("roof", roof_manager)
+telemetry_dispatcher.add_source("telescope", telescope_manager)
+# Heartbeat and dispatch run once for the app, however many browsers are connected
+device_service = deviceservice.DeviceService()
+device_service.every(0.1, roof_manager.update)
+device_service.every(0.1, telemetry_dispatcher.dispatch)
+app.on_startup(device_service.start)
+app.on_shutdown(device_service.stop)
+
+# FWHM, star count etc. of every frame the file browser has shown, measured once per file
+quality_index = qualityindex.QualityIndex()
+# Primary header keywords (filter, exposure, ...) of every frame the file browser has shown
+header_index = headerindex.HeaderIndex()
+app.on_shutdown(header_index.stop)
 
 class UI:
     def __init__(self):
@@ -172,8 +216,8 @@ class UI:
                 with ui.column():
                     with ui.card().classes('justify-center'):
                                 ui.label("Observatory Camera")
-                                #observatory_video = ui.interactive_image()
-                                #ui.timer(interval=0.1, callback=lambda: observatory_video.set_source(f'/video/frame/observatory_cam?{time.time()}'))
+                                # MJPEG stream, frames are encoded once on the server and shared by every viewer
+                                #observatory_video = ui.image('/video/stream/observatory_cam')
                     with ui.row().classes('w-full'):
                         with ui.column():
                             with ui.card().classes('w-full justify-center'):
@@ -184,21 +228,21 @@ class UI:
                                     ui.label('Telescope Controller')
                                     ui.label('CONNECTED')
                             with ui.card().classes('w-full justify-center'):
-                                roof_control_sw = ui.switch('Enable Roof Control', on_change=(lambda: reset_roof_motion(self.roof_control_ui)))
+                                roof_control_sw = ui.switch('Enable Roof Control', on_change=(lambda: on_roof_control_switched(self.roof_control_ui)))
                                 with ui.row().classes('w-full justify-between'):
                                     ui.label('Roof Position')
                                     self.roof_telem_ui.roof_position_label = ui.label('')
                                 with ui.row().classes('w-full'):
-                                    roof_raise_btn = ToggleButton('Raise', on_toggle_on=(lambda: roof_manager.raise_roof()), on_toggle_off=(lambda: stop_roof(self.roof_control_ui))).classes('flex-grow')
+                                    roof_raise_btn = ToggleButton('Raise', on_toggle_on=(lambda: start_roof_command(roof_raise_btn, roof_manager.raise_roof)), on_toggle_off=(lambda: stop_roof(self.roof_control_ui))).classes('flex-grow')
                                     roof_stop_btn = ui.button('Stop', on_click=(lambda: stop_roof(self.roof_control_ui))).classes('flex-grow')
-                                    roof_lower_btn = ToggleButton('Lower', on_toggle_on=(lambda: roof_manager.lower_roof()), on_toggle_off=(lambda: stop_roof(self.roof_control_ui))).classes('flex-grow')
+                                    roof_lower_btn = ToggleButton('Lower', on_toggle_on=(lambda: start_roof_command(roof_lower_btn, roof_manager.lower_roof)), on_toggle_off=(lambda: stop_roof(self.roof_control_ui))).classes('flex-grow')
                                 with ui.row().classes('w-full justify-between'):
                                     ui.label('Lock Position')
                                     self.roof_telem_ui.lock_position_label = ui.label('')
                                 with ui.row():
-                                    lock_engage_btn = ToggleButton('Engage', on_toggle_on=(lambda: roof_manager.engage_lock()), on_toggle_off=(lambda: stop_lock(self.roof_control_ui))).classes('flex-grow')
+                                    lock_engage_btn = ToggleButton('Engage', on_toggle_on=(lambda: start_roof_command(lock_engage_btn, roof_manager.engage_lock)), on_toggle_off=(lambda: stop_lock(self.roof_control_ui))).classes('flex-grow')
                                     lock_stop_btn = ui.button('Stop',  on_click=(lambda: stop_lock(self.roof_control_ui)))
-                                    lock_disengage_btn = ToggleButton('Disengage', on_toggle_on=(lambda: roof_manager.disengage_lock()), on_toggle_off=(lambda: stop_lock(self.roof_control_ui))).classes('flex-grow')
+                                    lock_disengage_btn = ToggleButton('Disengage', on_toggle_on=(lambda: start_roof_command(lock_disengage_btn, roof_manager.disengage_lock)), on_toggle_off=(lambda: stop_lock(self.roof_control_ui))).classes('flex-grow')
                             with ui.card().classes('w-full justify-center'):
                                 with ui.row().classes('w-full justify-between'):
                                     ui.label('Outside Temperature')
@@ -212,14 +256,12 @@ class UI:
                                 ui.switch('Lens Cap', on_change=(lambda e: telescope_manager.send_command(commsmanager.TelescopeCommand.LENS_CAP_OPEN if e.value == 1 else commsmanager.TelescopeCommand.LENS_CAP_CLOSE)))
                                 with ui.row().classes('w-full justify-between'):
                                     ui.label('State:')
-                                    lens_cap_state = customui.LensCapStateLabel()
-                                    ui.timer(0.1, callback=lambda: lens_cap_state.update_text(telescope_manager.last_data.lens_cap_driver_state, telescope_manager.last_data.lens_cap_manual_state, telescope_manager.last_data.lens_cap_real_state))
+                                    bind_state_label(customui.LensCapStateLabel(), "lens_cap")
                             with ui.card().classes('w-full justify-center'):
                                 ui.switch('Flat Light', on_change=(lambda e: telescope_manager.send_command(commsmanager.TelescopeCommand.LIGHT_ON if e.value == 1 else commsmanager.TelescopeCommand.LIGHT_OFF)))
                                 with ui.row().classes('w-full justify-between'):
                                     ui.label('State:')
-                                    lens_cap_state = customui.FlatLightLabel()
-                                    ui.timer(0.1, callback=lambda: lens_cap_state.update_text(telescope_manager.last_data.flat_light_driver_state, telescope_manager.last_data.flat_light_manual_state, telescope_manager.last_data.flat_light_real_state))
+                                    bind_state_label(customui.FlatLightLabel(), "flat_light")
                             with ui.card().classes('w-full justify-center'):
                                 ui.label("Roof Control Debug Menu")
                                 with ui.row().classes('w-full justify-between'):
@@ -243,6 +285,7 @@ class UI:
                                 with ui.row().classes('w-full justify-between'):
                                     ui.label('L2 Position')
                                     self.roof_telem_ui.lower_2_sw_label = ui.label()
+                                ui.button('H-Bridge Current Trace', on_click=self.show_current_trace).classes('w-full')
                             
                 with ui.column():
                     with ui.row():
@@ -256,16 +299,24 @@ class UI:
                                 with ui.row().classes('w-full'):
                                     with ui.column().classes('w-1/2 justify-center'):
                                         ui.label("File Browser")
-                                        
-                                        with ui.scroll_area().classes('w-full'):
-                                            browser = customui.FileBrowser(on_file_selected=recent_image.convert_fits_to_png).props('dense separator').classes('w-full')
-                                            ui.timer(interval=2, callback=browser.get_items_in_dir)
+                                        browser = customui.VirtualFileBrowser(on_file_selected=recent_image.set_image, on_prefetch=recent_image.prefetch, quality_index=quality_index, header_index=header_index).classes('w-full')
                                     with ui.column().classes('flex-grow justify-center h-full'):
                                         ui.input("Server Image Path", 
                                                 value=browser.directory,
-                                                on_change=lambda e: browser.set_dir(e.value)).classes('w-full')
+                                                on_change=lambda e: self.set_image_dir(browser, e.value)).classes('w-full')
                                         with ui.row().classes('w-full'):
                                             ui.switch("Show Most Recent")
+                            with ui.card().classes('w-full'):
+                                with ui.row().classes('w-full items-center'):
+                                    ui.label("Guiding Drift")
+                                    ui.switch("Live", on_change=lambda e: self.drift_monitor.start(browser.directory) if e.value else self.drift_monitor.stop())
+                                    ui.toggle({'stars': 'Stars', 'phase': 'Phase correlation'}, value='stars',
+                                              on_change=lambda e: self.drift_monitor.set_method(e.value))
+                                    self.drift_label = ui.label()
+                                # One point per frame, the x axis is the frame's mtime, so the window is the last 200 frames
+                                drift_plot = customui.Plot(["X drift", "Y drift", "FWHM"], window_samples=200, max_samples=2000, y_title='Pixels').classes('w-full')
+                                self.drift_monitor = driftmonitor.DriftMonitor(lambda record: self.show_drift(drift_plot, record))
+                                app.on_shutdown(self.drift_monitor.stop)
                                       
                         with ui.column():
                             with ui.card().classes('justify-center'):
@@ -282,59 +333,78 @@ class UI:
                                                 ui.switch('Primary', on_change=(lambda e: telescope_manager.send_command(commsmanager.TelescopeCommand.HEATER_1_ENABLE if e.value == 1 else commsmanager.TelescopeCommand.HEATER_1_DISABLE)))
                                                 with ui.row().classes('w-full justify-between'):
                                                     ui.label('State:')
-                                                    heater_1_state = customui.HeaterStateLabel()
-                                                    ui.timer(0.1, callback=lambda: heater_1_state.update_text(telescope_manager.last_data.heater_1_driver_state, telescope_manager.last_data.heater_1_manual_state, telescope_manager.last_data.heater_1_real_state))
+                                                    bind_state_label(customui.HeaterStateLabel(), "heater_1")
                                             with ui.card().classes("w-full"):
                                                 ui.switch('Secondary', on_change=(lambda e: telescope_manager.send_command(commsmanager.TelescopeCommand.HEATER_2_ENABLE if e.value == 1 else commsmanager.TelescopeCommand.HEATER_2_DISABLE)))
                                                 with ui.row().classes('w-full justify-between'):
                                                     ui.label('State:')
-                                                    heater_2_state = customui.HeaterStateLabel()
-                                                    ui.timer(0.1, callback=lambda: heater_2_state.update_text(telescope_manager.last_data.heater_2_driver_state, telescope_manager.last_data.heater_2_manual_state, telescope_manager.last_data.heater_2_real_state))
+                                                    bind_state_label(customui.HeaterStateLabel(), "heater_2")
                                             with ui.card().classes("w-full"):
                                                 ui.switch('Guidescope', on_change=(lambda e: telescope_manager.send_command(commsmanager.TelescopeCommand.HEATER_3_ENABLE if e.value == 1 else commsmanager.TelescopeCommand.HEATER_3_DISABLE)))
                                                 with ui.row().classes('w-full justify-between'):
                                                     ui.label('State:')
-                                                    heater_3_state = customui.HeaterStateLabel()
-                                                    ui.timer(0.1, callback=lambda: heater_3_state.update_text(telescope_manager.last_data.heater_3_driver_state, telescope_manager.last_data.heater_3_manual_state, telescope_manager.last_data.heater_3_real_state))
+                                                    bind_state_label(customui.HeaterStateLabel(), "heater_3")
+                                            # Temperatures are sampled once a second, so the window in samples is in seconds too
+                                            ui.select({300: '5 minutes', 3600: '1 hour', 12 * 3600: 'Night'}, value=300, label='Window',
+                                                      on_change=lambda e: temp_plot.set_window(e.value)).classes("w-full")
                                         temp_plot = customui.Plot(["Ambient", "Primary Mirror"]).classes("flex-grow")
-                                        ui.timer(1.0, callback=lambda: temp_plot.update_series([telescope_manager.last_data.temp_ref, telescope_manager.last_data.temp_1]))
+                                        device_service.every(1.0, lambda: temp_plot.update_series([telescope_manager.last_data.temp_ref, telescope_manager.last_data.temp_1]))
                         #ui.timer(interval=1, callback=lambda: update_latest_photo(recent_image))
                         #ui.label("Sky Camera")
                     #self.sky_video = ui.interactive_image().classes('w-full h-full')
                     #ui.timer(interval=0.1, callback=lambda: self.sky_video.set_source(f'/video/frame?{time.time()}'))
 
-        ui.timer(0.1, callback=lambda: update_telemetry(self.roof_telem_ui))
-        ui.timer(0.1, callback=lambda: roof_manager.update())
+        subscribe_telemetry(self.roof_telem_ui, self.roof_connected)
         
         self.roof_control_ui = RoofControlUI(enable_roof_control_sw=roof_control_sw, raise_roof_btn=ButtonConditions(roof_raise_btn), stop_roof_btn=ButtonConditions(roof_stop_btn), lower_roof_btn=ButtonConditions(roof_lower_btn), engage_lock_btn=ButtonConditions(lock_engage_btn), stop_lock_btn=ButtonConditions(lock_stop_btn), disengage_lock_btn=ButtonConditions(lock_disengage_btn))
-        self.roof_control_ui.raise_roof_btn.add_condition(lambda: self.roof_control_ui.enable_roof_control_sw.value)
-        self.roof_control_ui.raise_roof_btn.add_condition(lambda: roof_manager.last_data.roof_state != commsmanager.MotionState.RAISED)
-        self.roof_control_ui.raise_roof_btn.add_condition(lambda: roof_manager.last_data.roof_state != commsmanager.MotionState.LOWERING)
-        self.roof_control_ui.raise_roof_btn.add_condition(lambda: roof_manager.last_data.lock_state == commsmanager.MotionState.LOWERED or roof_manager.last_data.lock_state == commsmanager.MotionState.UNKNOWN)
- 
-        #self.roof_control_ui.stop_roof_btn.add_condition(lambda: self.roof_control_ui.enable_roof_control_sw.value)
-
-        self.roof_control_ui.lower_roof_btn.add_condition(lambda: self.roof_control_ui.enable_roof_control_sw.value)
-        self.roof_control_ui.lower_roof_btn.add_condition(lambda: roof_manager.last_data.roof_state != commsmanager.MotionState.LOWERED)
-        self.roof_control_ui.lower_roof_btn.add_condition(lambda: roof_manager.last_data.roof_state != commsmanager.MotionState.RAISING)
-        self.roof_control_ui.lower_roof_btn.add_condition(lambda: roof_manager.last_data.lock_state == commsmanager.MotionState.LOWERED or roof_manager.last_data.lock_state == commsmanager.MotionState.UNKNOWN)
-
-        self.roof_control_ui.engage_lock_btn.add_condition(lambda: self.roof_control_ui.enable_roof_control_sw.value)
-        self.roof_control_ui.engage_lock_btn.add_condition(lambda: roof_manager.last_data.lock_state != commsmanager.MotionState.RAISED)
-        self.roof_control_ui.engage_lock_btn.add_condition(lambda: roof_manager.last_data.lock_state != commsmanager.MotionState.LOWERING)
-
-        #self.roof_control_ui.stop_lock_btn.add_condition(lambda: self.roof_control_ui.enable_roof_control_sw.value)
-
-        self.roof_control_ui.disengage_lock_btn.add_condition(lambda: self.roof_control_ui.enable_roof_control_sw.value)
-        self.roof_control_ui.disengage_lock_btn.add_condition(lambda: roof_manager.last_data.lock_state != commsmanager.MotionState.LOWERED)
-        self.roof_control_ui.disengage_lock_btn.add_condition(lambda: roof_manager.last_data.lock_state != commsmanager.MotionState.RAISING)
-
-        ui.timer(0.1, callback=lambda: set_roof_buttons_state(self.roof_control_ui))
+        self.roof_control_ui.interlocks = interlocks.InterlockEngine(
+            interlocks.ROOF_INTERLOCKS,
+            control_enabled=roof_control_sw.value,
+            roof_state=roof_manager.last_data.roof_state,
+            lock_state=roof_manager.last_data.lock_state,
+            connected=roof_manager.connected)
+        for rule, conditions in (('raise_roof', self.roof_control_ui.raise_roof_btn), ('stop_roof', self.roof_control_ui.stop_roof_btn),
+                                 ('lower_roof', self.roof_control_ui.lower_roof_btn), ('engage_lock', self.roof_control_ui.engage_lock_btn),
+                                 ('stop_lock', self.roof_control_ui.stop_lock_btn), ('disengage_lock', self.roof_control_ui.disengage_lock_btn)):
+            self.roof_control_ui.interlocks.on_change(rule, conditions.set_enabled)
+
+        # Buttons depend on the roof/lock state, the connection and the enable switch
+        telemetry_dispatcher.subscribe("roof", ("roof_state", "lock_state", "connected"), lambda roof_state, lock_state, connected: set_roof_buttons_state(self.roof_control_ui, roof_state, lock_state, connected))
 
         roof_manager.on_raised(disable_roof_control)
         roof_manager.on_lowered(disable_roof_control)
         roof_manager.on_locked(disable_roof_control)
         roof_manager.on_unlocked(disable_roof_control)
+
+        with ui.dialog() as self.current_trace_dialog, ui.card():
+            self.current_trace_stats = ui.label()
+            self.current_trace_figure = go.Figure(go.Scatter(x=[], y=[], mode='lines', name='H-Bridge Current'))
+            self.current_trace_figure.update_layout(margin=dict(t=0, l=10, r=10, b=10), xaxis=dict(title='Seconds'), yaxis=dict(title='Current (A)'))
+            self.current_trace_plot = ui.plotly(self.current_trace_figure).classes('w-[600px]')
+            ui.button('Close', on_click=self.current_trace_dialog.close)
+
+    def set_image_dir(self, browser, directory):
+        browser.set_dir(directory)
+        if self.drift_monitor.running:
+            self.drift_monitor.start(browser.directory)
+
+    def show_drift(self, drift_plot, record):
+        drift_plot.update_series([record.dx, record.dy, record.fwhm], timestamp=record.timestamp)
+        self.drift_label.set_text(f"{os.path.basename(record.path)}: dx {record.dx:.2f} dy {record.dy:.2f} FWHM {record.fwhm:.2f} px, {record.stars} stars")
+
+    def show_current_trace(self):
+        """Show every H-bridge current sample since the last roof move."""
+        packets = roof_manager.motion_history()
+        stats = roof_manager.history.stats('h_bridge_current', since=packets['timestamp'][0]) if len(packets) else None
+        if stats is None:
+            self.current_trace_stats.text = "No samples recorded"
+        else:
+            self.current_trace_stats.text = f"{stats['count']} samples, min {stats['min']:0.2f}A, max {stats['max']:0.2f}A, mean {stats['mean']:0.2f}A"
+        start = packets['timestamp'][0] if len(packets) else 0
+        self.current_trace_figure.data[0].x = (packets['timestamp'] - start).tolist()
+        self.current_trace_figure.data[0].y = packets['h_bridge_current'].tolist()
+        self.current_trace_plot.update()
+        self.current_trace_dialog.open()
     
 
 
@@ -356,7 +426,7 @@ def format_motion_state(state):
 roof_port = None
 NUM_TELEM_ELEMENTS=7
 
-def set_roof_connected(connected: bool):
+def set_roof_connected(connected):
     global roof_port
     if connected:
         web_ui.roof_connected.text = "CONNECTED"
@@ -1,37 +1,52 @@
-from nicegui import ui, app
+from nicegui import ui, app, core, run, background_tasks
 import os
 import datetime
+import time
 import tempfile
-from astropy.io import fits
+import asyncio
+import json
 from PIL import Image
-import shutil
 import numpy as np
 import plotly.graph_objs as go
 import commsmanager
+import previewcache
+import dirindex
+import qualityindex
+import headerindex
+import preview
+import stretch
+
+class RelativeTimeLabel(ui.element, component='relative_time.js'):
+    """Label showing how long ago a timestamp was, e.g. "5 minutes ago".
+
+    The text is computed and kept current in the browser, so the server only
+    sends the timestamp once instead of rebuilding labels to refresh ages.
+    Timestamps are on the server's clock, so every browser that connects is
+    sent the server time and works out its own offset from it.
+    """
+    clock_synced_clients = set()  # ids of the clients that send the server time on connect
+
+    def __init__(self, timestamp) -> None:
+        super().__init__()
+        if self.client.id not in RelativeTimeLabel.clock_synced_clients:
+            RelativeTimeLabel.clock_synced_clients.add(self.client.id)
+            client = self.client
+            client.on_connect(lambda: sync_browser_clock(client))
+        self.set_timestamp(timestamp)
+
+    def set_timestamp(self, timestamp):
+        if self._props.get('timestamp') == timestamp:
+            return
+        self._props['timestamp'] = timestamp
+        self.update()
 
-class SelectableListItem(ui.button):
-    def get_readable_time_since_last_modified(self, timestamp):
-        """Return a human-readable string representing the time since the file was last modified."""
-
-        last_modified_time = datetime.datetime.fromtimestamp(timestamp)
-        now = datetime.datetime.now()
-
-        # Calculate the difference in time
-        time_diff = now - last_modified_time
-
-        # Determine the largest whole number time format
-        seconds = time_diff.total_seconds()
-        if seconds < 60:
-            return f"{int(seconds)} seconds ago"
-        minutes = seconds / 60
-        if minutes < 60:
-            return f"{int(minutes)} minutes ago"
-        hours = minutes / 60
-        if hours < 24:
-            return f"{int(hours)} hours ago"
-        days = hours / 24
-        return f"{int(days)} days ago"
 
+def sync_browser_clock(client):
+    # Runs in every browser connected to the client, each compares the server time with its own clock
+    client.run_javascript(f'window.relative_time_skew = {time.time() * 1000} - Date.now()')
+
+
+class SelectableListItem(ui.button):
     def __init__(self, file, on_click=None, selected=False) -> None:
         super().__init__()
         self._state = False
@@ -40,8 +55,9 @@ class SelectableListItem(ui.button):
         self.file = file[0]
         #self.update()
         with self:
-            ui.label(file[0]).classes('mr-auto')
-            ui.label(self.get_readable_time_since_last_modified(file[1])).classes('ml-auto')
+            self.name_label = ui.label(file[0]).classes('mr-auto')
+            self.detail_label = ui.label().classes('text-xs text-grey-5 ml-2')
+            self.time_label = RelativeTimeLabel(file[1]).classes('ml-auto')
         
         if selected: #when refreshing the file browser, keep selected files selected
             self._state = True
@@ -61,59 +77,302 @@ class SelectableListItem(ui.button):
     def is_clicked(self):
         return self._state
 
+    def set_mtime(self, timestamp):
+        self.time_label.set_timestamp(timestamp)
+
+    def set_file(self, file, selected=False, detail=''):
+        """Show a different file in this row, used when rows are recycled."""
+        if self.file is None:
+            self.props(remove='disable')
+            self.time_label.set_visibility(True)
+        self.file = file[0]
+        self.name_label.text = file[0]
+        self.detail_label.text = detail
+        self.set_mtime(file[1])
+        if self._state != selected:
+            self._state = selected
+            self.update()
+
+    def set_heading(self, text):
+        """Show a group heading in this row instead of a file, it can't be selected."""
+        self.file = None
+        self.name_label.text = text
+        self.detail_label.text = ''
+        self.time_label.set_visibility(False)
+        self._state = False
+        self.props('disable')
+        self.update()
+
     def unclick(self):
         self._state = False
         self.update()
 
 
-class FileBrowser(ui.list):
+class VirtualFileBrowser(ui.column):
+    """File browser that only materializes the rows in view, so large capture directories load as fast as small ones.
 
-    def __init__(self, on_file_selected, *args,  **kwargs) -> None:
-       
-        super().__init__(*args,  **kwargs)
-        
+    A fixed pool of rows is recycled as the list scrolls, with spacers above and
+    below standing in for the rest. Sorting and filtering run on the directory index.
+    With a QualityIndex, new files are measured in the background and the list
+    can also be sorted and filtered by FWHM, star count, eccentricity and background.
+    With a HeaderIndex, primary headers are read in the background and the list
+    can be sorted and grouped by header keywords such as FILTER or EXPTIME.
+    """
+    ROW_HEIGHT = 40  # px, every row has the same height so scroll offsets map directly to rows
+    GROUP_KEYS = {'OBJECT': 'Object', 'IMAGETYP': 'Frame type', 'FILTER': 'Filter', 'EXPTIME': 'Exposure'}
+
+    def __init__(self, on_file_selected, on_prefetch=None, visible_rows=12, overscan=6, quality_index=None, header_index=None) -> None:
+        super().__init__()
         self.directory="/Users/adampaul/Local Documents/Astrophotography/M106/Raw"
-        
+        self.index = dirindex.DirectoryIndex(self.directory)
+        self.stop_watching = None
+        self.on_file_selected = on_file_selected
+        # Called with the paths of the files around a new selection, nearest first
+        self.on_prefetch = on_prefetch
+        self.prefetch_count = 3
+
         self.clicked_file = None
+        self.sort_key = 'mtime'
+        self.descending = True
+        self.name_filter = ''
+        self.quality_index = quality_index
+        self.quality = {}  # name -> quality metrics of the measured files
+        self.max_fwhm = None
+        self.min_stars = None
+        self.header_index = header_index
+        self.headers = {}  # name -> header keyword values of the files read so far
+        self.group_key = ''
+        self.view = []  # (name, mtime) of every file matching the filter, in display order
+        self.first_row = 0
+        self.overscan = overscan
+
+        with self:
+            with ui.row().classes('w-full no-wrap items-center'):
+                ui.input('Filter', on_change=lambda e: self.set_filter(e.value)).props('dense clearable').classes('flex-grow')
+                sort_keys = {'mtime': 'Modified', 'name': 'Name'}
+                if quality_index is not None:
+                    sort_keys.update({'fwhm': 'FWHM', 'stars': 'Stars', 'eccentricity': 'Eccentricity', 'background': 'Background'})
+                if header_index is not None:
+                    sort_keys.update({'DATE-OBS': 'Date observed', 'EXPTIME': 'Exposure', 'FILTER': 'Filter', 'GAIN': 'Gain'})
+                ui.select(sort_keys, value=self.sort_key, on_change=lambda e: self.set_sort(e.value)).props('dense')
+                ui.button(icon='swap_vert', on_click=self.toggle_sort_direction).props('flat dense')
+                if header_index is not None:
+                    ui.select({'': 'No grouping', **self.GROUP_KEYS}, value=self.group_key, on_change=lambda e: self.set_group(e.value)).props('dense')
+            if quality_index is not None:
+                with ui.row().classes('w-full no-wrap items-center'):
+                    ui.number('Max FWHM', min=0, step=0.1, on_change=lambda e: self.set_quality_filter(max_fwhm=e.value)).props('dense clearable').classes('flex-grow')
+                    ui.number('Min stars', min=0, step=1, on_change=lambda e: self.set_quality_filter(min_stars=e.value)).props('dense clearable').classes('flex-grow')
+            with ui.scroll_area(on_scroll=self.handle_scroll).classes('w-full').style(f'height: {visible_rows * self.ROW_HEIGHT}px'):
+                self.top_spacer = ui.element('div')
+                self.rows = []
+                for _ in range(visible_rows + 2 * overscan):
+                    row = SelectableListItem(('', 0), on_click=self.item_clicked).classes('w-full').style(f'height: {self.ROW_HEIGHT}px')
+                    row.set_visibility(False)
+                    self.rows.append(row)
+                self.bottom_spacer = ui.element('div')
+
         self.get_items_in_dir()
 
-        self.on_file_selected = on_file_selected
-        
+        # Start watching once the event loop is running
+        ui.timer(0.1, self.watch_directory, once=True)
+
     def set_dir(self, directory):
         if os.path.isdir(directory):
             self.directory = directory
+            self.index = dirindex.DirectoryIndex(directory)
+            self.first_row = 0
             self.get_items_in_dir()
+            if self.stop_watching is not None:
+                self.stop_watching.set()  # the watcher restarts on the new directory
 
     def get_items_in_dir(self):
-        # List all files in the directory
-        self.clear()
-        files = []
-        self.items = []
-        for entry in os.listdir(self.directory):
-            # Join the directory path and entry name to get full path
-            full_path = os.path.join(self.directory, entry)
-            # Check if the entry is a file and add to list
-            if os.path.isfile(full_path) and entry.endswith('.fits'):
-                files.append((os.path.basename(entry), os.path.getmtime(full_path)))
-        
-        files.sort(key=lambda x: x[1], reverse=True)
-        with self:
-            ui.separator()
-            for file in files:
-                self.items.append(SelectableListItem(file, on_click=self.item_clicked, selected=self.clicked_file==file[0]).classes("w-full"))
-                ui.separator()
+        """Rescan the whole directory and refresh the rows in view."""
+        try:
+            self.index.rescan()
+        except OSError as e:
+            print(f"unable to list {self.directory} with error {e}")
+            return
+        self.update_metadata()
+
+    async def watch_directory(self):
+        """Apply file system events for the current directory as they arrive."""
+        self.update_metadata()
+        while not self.is_deleted:
+            self.stop_watching = asyncio.Event()
+            await dirindex.watch_directory(self.index, self.apply_changes, self.stop_watching)
+
+    def apply_changes(self, changes):
+        """Apply one batch of file system events, reading and re-rendering only what the changed files affect."""
+        for name in changes.removed + changes.modified:
+            self.headers.pop(name, None)
+            self.quality.pop(name, None)
+        changed = changes.added + changes.modified
+        if changed:
+            self.load_metadata({name: self.index.entries[name] for name in changed if name in self.index.entries})
+        self.refresh_view(changed=set(changed + changes.removed))
+
+    def update_metadata(self):
+        """Show the headers and metrics already indexed for the whole directory and queue the files that haven't been read or measured."""
+        self.headers = {}
+        self.quality = {}
+        self.load_metadata(self.index.entries)
+        self.refresh_view()
+
+    def load_metadata(self, entries):
+        """Add the indexed headers and metrics of entries (name -> mtime) and queue the ones that haven't been read or measured."""
+        # The first scan happens before the event loop runs, watch_directory queues it once it does
+        loop_running = core.loop is not None
+        if self.header_index is not None:
+            self.headers.update(self.header_index.headers(self.directory, entries, self.index.sizes))
+            unread = self.header_index.unread(self.directory, entries, self.index.sizes)
+            if unread and loop_running:
+                background_tasks.create(self.header_index.load(self.directory, unread, self.headers_read), name='read FITS headers')
+        if self.quality_index is not None:
+            self.quality.update(self.quality_index.metrics(self.directory, entries))
+            unmeasured = {name: mtime for name, mtime in entries.items() if name not in self.quality}
+            if unmeasured and loop_running:
+                background_tasks.create(
+                    self.quality_index.index_directory(self.directory, unmeasured, self.quality_measured),
+                    name='index frame quality')
+
+    def headers_read(self, names):
+        if self.is_deleted:
+            return
+        entries = {name: self.index.entries[name] for name in names if name in self.index.entries}
+        self.headers.update(self.header_index.headers(self.directory, entries, self.index.sizes))
+        self.refresh_view(changed=set(names))
 
+    def quality_measured(self, names):
+        if self.is_deleted:
+            return
+        entries = {name: self.index.entries[name] for name in names if name in self.index.entries}
+        self.quality.update(self.quality_index.metrics(self.directory, entries))
+        self.refresh_view(changed=set(names))
+
+    def set_filter(self, name_filter):
+        self.name_filter = name_filter or ''
+        self.first_row = 0
+        self.refresh_view()
+
+    def set_sort(self, sort_key):
+        self.sort_key = sort_key
+        self.refresh_view()
+
+    def toggle_sort_direction(self):
+        self.descending = not self.descending
+        self.refresh_view()
+
+    def set_group(self, group_key):
+        self.group_key = group_key or ''
+        self.first_row = 0
+        self.refresh_view()
+
+    def set_quality_filter(self, **limits):
+        for name, value in limits.items():
+            setattr(self, name, value)
+        self.first_row = 0
+        self.refresh_view()
+
+    def refresh_view(self, changed=None):
+        """Rebuild the view from the index and re-render the rows.
+
+        With changed (names of files added, removed or with new details) the
+        rows are only re-rendered if the files in view, or one of their rows,
+        changed. Otherwise just the spacers follow the length of the list.
+        """
+        visible = self.visible_files()
+        self.view = self.sorted_files()
+        if self.header_index is not None and self.group_key:
+            # Each group gets a heading row, (None, heading) in the view
+            grouped = []
+            for value, files in headerindex.group_by_keyword(self.view, self.headers, self.group_key):
+                label = self.GROUP_KEYS[self.group_key]
+                heading = f"No {label.lower()}" if value is None else f"{label}: {value}"
+                grouped.append((None, f"{heading} ({len(files)})"))
+                grouped += files
+            self.view = grouped
+        if changed is None or self.visible_files() != visible or any(file[0] in changed for file in visible):
+            self.render_rows()
+        else:
+            self.update_spacers()
+
+    def sorted_files(self):
+        """(name, mtime) of the files passing the filters, in the selected sort order."""
+        quality_sort = self.sort_key in qualityindex.QUALITY_COLUMNS
+        quality_filter = self.quality_index is not None and (self.max_fwhm is not None or self.min_stars is not None)
+        if self.quality_index is not None and quality_sort:
+            # The name filter is cheap enough to apply to the ranked names
+            ranked = self.quality_index.query(self.directory, self.index.entries, self.sort_key, self.descending, self.max_fwhm, self.min_stars)
+            name_filter = self.name_filter.lower()
+            files = [file for file in ranked if name_filter in file[0].lower()]
+            if not quality_filter:
+                # Frames still being measured go at the end
+                files += [file for file in self.index.query('mtime', True, self.name_filter) if file[0] not in self.quality]
+            return files
+
+        if self.header_index is not None and self.sort_key in headerindex.HEADER_KEYWORDS:
+            files = headerindex.sort_by_keyword(self.index.query('mtime', self.descending, self.name_filter), self.headers, self.sort_key, self.descending)
+        else:
+            files = self.index.query(self.sort_key, self.descending, self.name_filter)
+        if quality_filter:
+            matching = {name for name, _ in self.quality_index.query(self.directory, self.index.entries, 'fwhm', False, self.max_fwhm, self.min_stars)}
+            files = [file for file in files if file[0] in matching]
+        return files
+
+    def handle_scroll(self, e):
+        first_row = max(0, int(e.vertical_position // self.ROW_HEIGHT) - self.overscan)
+        # Only re-render once the overscan is half used up
+        if abs(first_row - self.first_row) >= max(1, self.overscan // 2):
+            self.first_row = first_row
+            self.render_rows()
+
+    def visible_files(self):
+        """The part of the view the row pool shows."""
+        first_row = max(0, min(self.first_row, len(self.view) - len(self.rows)))
+        return self.view[first_row:first_row + len(self.rows)]
+
+    def render_rows(self):
+        self.first_row = max(0, min(self.first_row, len(self.view) - len(self.rows)))
+        for offset, row in enumerate(self.rows):
+            position = self.first_row + offset
+            if position < len(self.view) and self.view[position][0] is None:
+                row.set_heading(self.view[position][1])
+                row.set_visibility(True)
+            elif position < len(self.view):
+                name = self.view[position][0]
+                details = (headerindex.format_header(self.headers.get(name)), qualityindex.format_quality(self.quality.get(name)))
+                row.set_file(self.view[position], selected=name == self.clicked_file, detail=' · '.join(detail for detail in details if detail))
+                row.set_visibility(True)
+            else:
+                row.set_visibility(False)
+        self.update_spacers()
+
+    def update_spacers(self):
+        self.first_row = max(0, min(self.first_row, len(self.view) - len(self.rows)))
+        rows_below = max(0, len(self.view) - self.first_row - len(self.rows))
+        self.top_spacer.style(f'height: {self.first_row * self.ROW_HEIGHT}px')
+        self.bottom_spacer.style(f'height: {rows_below * self.ROW_HEIGHT}px')
 
     def item_clicked(self, item):
         self.clicked_file = item.file
-        for element in self.items:
-            if element != item and element.is_clicked():
-                element.unclick()
+        for row in self.rows:
+            if row != item and row.is_clicked():
+                row.unclick()
         self.on_file_selected(os.path.join(self.directory, item.file))
-        
-        
-    def add_item():
-        print("item added")
+        if self.on_prefetch is not None:
+            self.on_prefetch(self.neighbouring_files(item.file))
+
+    def neighbouring_files(self, name):
+        """Paths of up to prefetch_count files either side of name in the current view, alternating next/previous, nearest first."""
+        names = [file[0] for file in self.view if file[0] is not None]
+        index = names.index(name)
+        paths = []
+        for distance in range(1, self.prefetch_count + 1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < len(names):
+                    paths.append(os.path.join(self.directory, names[neighbour]))
+        return paths
+
 
 class HeaterStateLabel(ui.label):
     def __init__(self):
@@ -176,15 +435,42 @@ class FlatLightLabel(ui.label):
         self.update()
 
 
+def min_max_decimate(x, y, stride):
+    """Reduce each series to the min and max of every stride consecutive samples, kept in time order.
+
+    x has shape (n,) and y (series, n) with n a multiple of stride. Returns x
+    and y arrays of shape (series, 2 * n / stride), or the input unchanged
+    (x repeated per series) when stride is 1.
+    """
+    if stride == 1:
+        return np.broadcast_to(x, y.shape), y
+    buckets = y.shape[1] // stride
+    blocks = y.reshape(len(y), buckets, stride)
+    low = blocks.argmin(axis=2)
+    high = blocks.argmax(axis=2)
+    offsets = np.stack((np.minimum(low, high), np.maximum(low, high)), axis=2).reshape(len(y), 2 * buckets)
+    indices = offsets + np.repeat(np.arange(buckets) * stride, 2)
+    return x[indices], np.take_along_axis(y, indices, axis=1)
+
+
 class Plot(ui.plotly):
-    def __init__(self, series_labels):
+    """Rolling time series plot that streams new points to the browser instead of resending the figure.
+
+    Samples go into a NumPy ring buffer of max_samples. The window is the
+    last window_samples samples, whatever their timestamps, so it is a time
+    span only for callers adding samples at a fixed rate (e.g. 300 samples
+    once a second for 5 minutes). It is decimated server side (min/max per
+    bucket) to at most max_buckets buckets, and each completed bucket is
+    appended in the browser with Plotly.extendTraces, so an update costs the
+    same for a 5 minute or a full night window. The full figure is only sent
+    when a client connects or the window changes.
+    """
+
+    def __init__(self, series_labels, window_samples=300, max_samples=12 * 3600, max_buckets=600, y_title='Temperature (C)'):
         self.temperature_graph = go.Figure()
-        self.x_data = []
-        self.y_data = []
         for i, label in enumerate(series_labels):
-            self.y_data.append([])
              # Adding the trace
-            self.temperature_graph.add_trace(go.Scatter(x=self.x_data, y=self.y_data[i], mode='lines', name=label))
+            self.temperature_graph.add_trace(go.Scatter(x=[], y=[], mode='lines', name=label))
        
 
         # Updating the layout to set the background color to transparent
@@ -205,57 +491,201 @@ class Plot(ui.plotly):
 
             xaxis=dict(
                 title='Time', 
+                type='date',
                 title_font=dict(color='white'),  # Axis title font color
                 tickfont=dict(color='white'),    # Axis tick font color
                 gridcolor='grey'  # Grid line color
             ),
                 yaxis=dict(
-                title='Temperature (C)', 
+                title=y_title, 
                 title_font=dict(color='white'),  # Axis title font color
                 tickfont=dict(color='white'),    # Axis tick font color
                 gridcolor='grey'  # Grid line color
             )
         )
+
+        # Ring buffer of every sample, x in local time milliseconds as plotly expects for date axes
+        self.capacity = max_samples
+        self.max_buckets = max_buckets
+        self.utc_offset = datetime.datetime.now().astimezone().utcoffset().total_seconds()
+        self.x_data = np.zeros(self.capacity)
+        self.y_data = np.zeros((len(series_labels), self.capacity))
+        self.count = 0  # total samples ever added
+        self.set_window_size(window_samples)
+
         super().__init__(self.temperature_graph)
         # Display the plot using NiceGUI
-    
-    def update_series(self, data):
-        if len(self.x_data) == 0:
-            self.x_data.append(0)
-        else:
-            self.x_data.append(self.x_data[-1]+1)
-        
-        for idx, point in enumerate(data):
-            self.y_data[idx].append(point)
+        self.client.on_connect(self.update)
 
-        if len(self.x_data) > 50:
-            for idx, element in enumerate(self.y_data):
-                self.y_data[idx].pop(0)
-            self.x_data.pop(0)
-
-        for idx, element in enumerate(self.y_data):
-            self.temperature_graph.data[idx].x = self.x_data
-            self.temperature_graph.data[idx].y = element
+    def set_window_size(self, window_samples):
+        self.window_samples = min(self.capacity, max(1, int(window_samples)))
+        self.stride = max(1, -(-self.window_samples // self.max_buckets))
+        self.window_samples -= self.window_samples % self.stride
 
+    def set_window(self, window_samples):
+        """Change the number of samples shown and resend the figure."""
+        self.set_window_size(window_samples)
         self.update()
 
+    def max_points(self):
+        return self.window_samples if self.stride == 1 else 2 * self.window_samples // self.stride
+
+    def samples(self, start, end):
+        """x and y of the samples with absolute indices start to end, which must still be in the ring buffer."""
+        indices = np.arange(start, end) % self.capacity
+        return self.x_data[indices], self.y_data[:, indices]
+
+    def update_series(self, data, timestamp=None):
+        """Add one sample per series, taken at timestamp (epoch seconds, default now)."""
+        index = self.count % self.capacity
+        self.x_data[index] = ((time.time() if timestamp is None else timestamp) + self.utc_offset) * 1000
+        self.y_data[:, index] = data
+        self.count += 1
+
+        # Only whole buckets are sent, the same boundaries the full figure uses
+        if self.count % self.stride != 0 or not self.client.has_socket_connection:
+            return
+        x, y = min_max_decimate(*self.samples(self.count - self.stride, self.count), self.stride)
+        update = json.dumps(dict(x=x.tolist(), y=y.tolist()))
+        self.client.run_javascript(f'Plotly.extendTraces(getElement({self.id}).$el, {update}, {list(range(len(y)))}, {self.max_points()})')
+
+    def update(self) -> None:
+        end = self.count - self.count % self.stride
+        start = max(0, end - self.window_samples, self.count - self.capacity)
+        start += -start % self.stride
+        x, y = min_max_decimate(*self.samples(start, end), self.stride)
+        for idx, element in enumerate(y):
+            self.temperature_graph.data[idx].x = x[idx].tolist()
+            self.temperature_graph.data[idx].y = element.tolist()
+
+        super().update()
+
 
 class FITSViewer(ui.image):
-    def __init__(self) -> None:
+    def __init__(self, cache=None) -> None:
         self.tmpdir = tempfile.TemporaryDirectory()
         self.last_converted = None
         self.converted_path = os.path.join(self.tmpdir.name, "converted.png")
+        self.cache = cache if cache is not None else previewcache.PreviewCache()
+        # Stretch and output parameters, all part of the preview cache key
+        self.preview_width = preview.PREVIEW_WIDTH
+        # Quality knob: raw frames are binned by this factor before stretching.
+        # None bins down to about twice the preview width, 1 stretches the full frame.
+        self.bin_factor = None
+        self.bin_method = 'mean'  # or 'median'
+        self.read_step = 1  # >1 reads only every n-th row and column, for slow storage
+        self.clip_low = stretch.CLIP_LOW
+        self.clip_high = stretch.CLIP_HIGH
+        self.stretch_sample_size = 1_000_000  # None to histogram every pixel
+        self.exact_stretch = False  # True reproduces the original full histogram stretch
+        # Newest file the user asked for and the task converting it, older requests are dropped
+        self.requested_key = None
+        self.requested_path = None
+        self.worker = None
+        # Speculative renders of neighbouring files, run one at a time when the user isn't waiting on a conversion
+        self.prefetch_queue = []
+        self.prefetch_task = None
+        # Bytes of source pixels prefetches may load per selection (file size, reduced by read_step).
+        # That's what each render holds in its worker process, the PNGs it produces are much smaller.
+        self.prefetch_budget_bytes = 256 * 1024 * 1024
+        self.rendering = {}  # key -> running render task, shared by requests and prefetches
         self.create_placeholder_img()
         super().__init__(self.converted_path)
+        with self:
+            self.spinner = ui.spinner(size='3em').classes('absolute-center')
+        self.spinner.set_visibility(False)
 
     def set_image(self, image_path):
-        if self.last_converted == image_path:
+        key = self.cache_key(image_path)
+        if key == self.last_converted or key == self.requested_key:
+            return
+        self.requested_key = key
+        self.requested_path = image_path
+
+        png_data = self.cache.get(key)
+        if png_data is not None:
+            self.show_png(key, png_data)
             return
-        else:
-            self.convert_fits_to_png(image_path)
-            self.last_converted = image_path
-            self.force_reload()
-        pass
+
+        self.spinner.set_visibility(True)
+        if self.worker is None or self.worker.done():
+            self.worker = background_tasks.create(self.convert_requested(), name='convert fits')
+
+    async def convert_requested(self):
+        """Convert the most recently requested file in the process pool until no newer request is waiting."""
+        while self.requested_key is not None and self.requested_key != self.last_converted:
+            key, path = self.requested_key, self.requested_path
+            png_data = self.cache.get(key)
+            if png_data is None:
+                try:
+                    png_data = await self.render_cached(key, path)
+                except Exception as e:
+                    print(f"unable to convert {path} with error {e}")
+                    if key == self.requested_key:
+                        self.requested_key = None
+                    continue
+                if png_data is None:  # app is shutting down
+                    return
+            # Results for superseded requests are cached but not shown
+            if key == self.requested_key:
+                self.show_png(key, png_data)
+        self.spinner.set_visibility(False)
+
+    async def render_cached(self, key, path):
+        """Render a file in the process pool and cache it, sharing the work with an identical render already running."""
+        render = self.rendering.get(key)
+        if render is None:
+            render = asyncio.ensure_future(run.cpu_bound(preview.fits_to_png, path, **self.render_params()))
+            self.rendering[key] = render
+            render.add_done_callback(lambda _: self.rendering.pop(key, None))
+        png_data = await asyncio.shield(render)
+        if png_data is not None:
+            self.cache.put(key, png_data)
+        return png_data
+
+    def prefetch(self, image_paths):
+        """Render image_paths into the cache in the background, replacing any earlier prefetch request."""
+        self.prefetch_queue = list(image_paths)
+        if self.prefetch_task is None or self.prefetch_task.done():
+            self.prefetch_task = background_tasks.create(self.run_prefetch(), name='prefetch fits')
+
+    async def run_prefetch(self):
+        """Render the prefetch queue one file at a time, within prefetch_budget_bytes of source data per selection.
+
+        The budget counts the file bytes each render loads in its worker
+        process, so it bounds memory rather than the size of the output PNGs.
+        """
+        queue = None
+        used_bytes = 0
+        while self.prefetch_queue:
+            if queue is not self.prefetch_queue:
+                # A new selection replaced the queue, start a fresh budget
+                queue = self.prefetch_queue
+                used_bytes = 0
+            if self.worker is not None and not self.worker.done():
+                # Requested images always go first
+                await asyncio.wait([self.worker])
+                continue
+
+            path = queue.pop(0)
+            try:
+                key = self.cache_key(path)
+                if key in self.cache:
+                    continue
+                source_bytes = os.path.getsize(path) // self.read_step ** 2
+                if used_bytes + source_bytes > self.prefetch_budget_bytes:
+                    queue.clear()
+                    break
+                used_bytes += source_bytes
+                png_data = await self.render_cached(key, path)
+            except Exception as e:
+                print(f"unable to prefetch {path} with error {e}")
+                continue
+            if png_data is None:  # app is shutting down
+                return
+
+    def cache_key(self, fits_image_path):
+        return self.cache.make_key(fits_image_path, **self.render_params())
 
     def create_placeholder_img(self):
         # Create a blank white image
@@ -265,47 +695,27 @@ class FITSViewer(ui.image):
         image.save(self.converted_path)
 
     def convert_fits_to_png(self, fits_image_path):
-        # Load the FITS file
-        with fits.open(fits_image_path) as hdul:
-            image_data = hdul[0].data
-
-        image_data = np.nan_to_num(image_data)
-
-        # Calculate the histogram of the image data
-        histogram, bin_edges = np.histogram(image_data.flatten(), bins='auto', density=True)
-
-        # Compute cumulative distribution from the histogram
-        cdf = histogram.cumsum()
-        cdf_normalized = cdf / cdf[-1]  # Normalize
-
-        # Determine clipping points (e.g., 0.25% and 99.75%)
-        cdf_min = np.searchsorted(cdf_normalized, 0.0025)
-        cdf_max = np.searchsorted(cdf_normalized, 0.9975)
+        """Convert and show a file synchronously, blocking the caller while it renders."""
+        key = self.cache_key(fits_image_path)
+        png_data = self.cache.get(key)
+        if png_data is None:
+            png_data = self.render_png(fits_image_path)
+            self.cache.put(key, png_data)
+        self.show_png(key, png_data)
 
-        # Clip the image data to these points and scale to 0-255
-        clipped_data = np.clip(image_data, bin_edges[cdf_min], bin_edges[cdf_max])
-        scaled_data = (clipped_data - bin_edges[cdf_min]) / (bin_edges[cdf_max] - bin_edges[cdf_min]) * 255
-        image_uint8 = scaled_data.astype(np.uint8)
-
-        # Convert to PIL image
-        image = Image.fromarray(image_uint8)
-
-        original_width, original_height = image.size
-        
-        # New width
-        new_width = 900
-        
-        # Calculate the new height maintaining the aspect ratio
-        new_height = int(new_width * original_height / original_width)
-        
-        # Resize the image
-        resized_img = image.resize((new_width, new_height), Image.LANCZOS)
+        return True
 
-        
-        # Save the image as PNG
-        resized_img.save(self.converted_path, 'PNG')
+    def show_png(self, key, png_data):
+        with open(self.converted_path, "wb") as file:
+            file.write(png_data)
+        self.last_converted = key
+        self.requested_key = key
+        self.spinner.set_visibility(False)
         self.force_reload()
 
+    def render_params(self):
+        return dict(width=self.preview_width, read_step=self.read_step, bin_factor=self.bin_factor, bin_method=self.bin_method, clip_low=self.clip_low,
+                    clip_high=self.clip_high, sample_size=self.stretch_sample_size, exact=self.exact_stretch)
 
-        return True
-
+    def render_png(self, fits_image_path):
+        return preview.fits_to_png(fits_image_path, **self.render_params())
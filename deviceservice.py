@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+
+class DeviceService:
+    """Runs the periodic device work (heartbeats, telemetry dispatch, sampling) once for the whole app.
+
+    Jobs run on a single asyncio task started with the app rather than on
+    ui.timers, so serial traffic and polling don't depend on how many browser
+    tabs are open. Results reach clients through the TelemetryDispatcher.
+    """
+
+    def __init__(self):
+        self.jobs = []  # [interval, callback, next due time]
+        self.task = None
+
+    def every(self, interval, callback):
+        """Call callback every interval seconds, starting on the next tick."""
+        self.jobs.append([interval, callback, 0])
+
+    def start(self):
+        """Start the job loop, must be called on the app's event loop (e.g. from app.on_startup)."""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run(), name="device service")
+
+    async def stop(self):
+        task, self.task = self.task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            for job in self.jobs:
+                interval, callback, due = job
+                if now < due:
+                    continue
+                # Skip missed ticks rather than bursting to catch up
+                job[2] = max(due + interval, now)
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"device job {callback} failed with error {e}")
+            next_due = min((job[2] for job in self.jobs), default=now + 0.1)
+            await asyncio.sleep(max(0, next_due - time.monotonic()))
@@ -0,0 +1,130 @@
+import os
+import stat
+import asyncio
+import traceback
+import watchfiles
+from dataclasses import dataclass, field
+
+
+@dataclass
+class DirectoryChanges:
+    added: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    modified: list = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+
+class DirectoryIndex:
+    """Index of the FITS files in a directory, kept up to date by diffing rather than rebuilding."""
+
+    def __init__(self, directory, extensions=('.fits',)):
+        self.directory = directory
+        self.real_directory = os.path.realpath(directory)
+        self.extensions = extensions
+        self.entries = {}  # file name -> mtime
+        self.sizes = {}  # file name -> size in bytes
+
+    def scan(self):
+        """Return name -> mtime and name -> size for every matching file, one scandir pass with no extra stat calls on Linux."""
+        entries = {}
+        sizes = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(self.extensions) and entry.is_file():
+                    entry_stat = entry.stat()
+                    entries[entry.name] = entry_stat.st_mtime
+                    sizes[entry.name] = entry_stat.st_size
+        return entries, sizes
+
+    def rescan(self):
+        """Rescan the whole directory and return what changed since the last scan."""
+        new_entries, new_sizes = self.scan()
+        changes = DirectoryChanges()
+        for name, mtime in new_entries.items():
+            if name not in self.entries:
+                changes.added.append(name)
+            elif self.entries[name] != mtime or self.sizes.get(name) != new_sizes[name]:
+                changes.modified.append(name)
+        changes.removed = [name for name in self.entries if name not in new_entries]
+        self.entries = new_entries
+        self.sizes = new_sizes
+        return changes
+
+    def update_paths(self, paths):
+        """Restat only the given paths (e.g. from a file watcher) and return what changed."""
+        changes = DirectoryChanges()
+        for path in set(paths):
+            # Only the directory is resolved, a frame may be a symlink to a file elsewhere
+            if os.path.realpath(os.path.dirname(path)) != self.real_directory:
+                continue
+            name = os.path.basename(path)
+            if not name.endswith(self.extensions):
+                continue
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                file_stat = None
+            if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+                self.sizes.pop(name, None)
+                if self.entries.pop(name, None) is not None:
+                    changes.removed.append(name)
+            elif name not in self.entries:
+                self.entries[name] = file_stat.st_mtime
+                self.sizes[name] = file_stat.st_size
+                changes.added.append(name)
+            elif self.entries[name] != file_stat.st_mtime or self.sizes.get(name) != file_stat.st_size:
+                self.entries[name] = file_stat.st_mtime
+                self.sizes[name] = file_stat.st_size
+                changes.modified.append(name)
+        return changes
+
+    def query(self, sort_key='mtime', descending=True, name_filter=''):
+        """(name, mtime) pairs whose name contains name_filter (case insensitive), sorted by 'mtime' or 'name'."""
+        entries = self.entries.items()
+        if name_filter:
+            name_filter = name_filter.lower()
+            entries = [entry for entry in entries if name_filter in entry[0].lower()]
+        column = 1 if sort_key == 'mtime' else 0
+        return sorted(entries, key=lambda x: x[column], reverse=descending)
+
+
+async def watch_directory(index, on_changes, stop_event, poll_interval=2):
+    """Call on_changes with the diff for every batch of file system events in index.directory until stop_event is set.
+
+    If the directory can't be watched (missing, unsupported file system) it is
+    rescanned every poll_interval seconds instead. Errors raised by on_changes
+    are printed and the watch carries on.
+    """
+    reported = False
+    while not stop_event.is_set():
+        try:
+            async for events in watchfiles.awatch(index.directory, stop_event=stop_event, recursive=False):
+                notify(on_changes, index.update_paths(path for _, path in events))
+            return
+        except (OSError, RuntimeError) as e:
+            if not reported:
+                print(f"unable to watch {index.directory} with error {e}, rescanning every {poll_interval}s")
+                reported = True
+        try:
+            await asyncio.wait_for(stop_event.wait(), poll_interval)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            changes = index.rescan()
+        except OSError:
+            continue
+        notify(on_changes, changes)
+
+
+def notify(on_changes, changes):
+    # A bug in the callback shouldn't look like a watch failure, or stop the watch
+    if not changes:
+        return
+    try:
+        on_changes(changes)
+    except Exception:
+        print("error while applying directory changes")
+        traceback.print_exc()
@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import numpy as np
+from nicegui import run, background_tasks
+import dirindex
+import trackingerror
+
+# A new file is measured once its size and mtime have been stable for this long, so half written frames are skipped
+SETTLE_TIME = 2.0
+
+
+@dataclass
+class DriftRecord:
+    path: str
+    timestamp: float  # file mtime
+    dx: float  # shift from the previous frame in pixels, NaN for the first frame or when it couldn't be measured
+    dy: float
+    fwhm: float  # median star FWHM in pixels, NaN with the phase correlation method
+    stars: int
+
+
+class DriftMonitor:
+    """Measures guiding drift on each frame as it is written to the capture directory.
+
+    Files already in the directory when monitoring starts are left alone.
+    Every new frame is measured once, after it stops changing for
+    settle_time, against the frame before it: with star catalogs ('stars',
+    which also gives FWHM, and are cached on disk) or phase correlation
+    ('phase'). on_frame is called with a DriftRecord for each frame.
+    """
+
+    def __init__(self, on_frame, method='stars', settle_time=SETTLE_TIME, history=1000):
+        if method not in trackingerror.DRIFT_METHODS:
+            raise ValueError(f"unknown drift method {method}")
+        self.on_frame = on_frame
+        self.method = method
+        self.settle_time = settle_time
+        self.records = deque(maxlen=history)
+        self.directory = None
+        self.stop_event = None
+        self.task = None
+        self.pending = {}  # path -> ((size, mtime_ns), time first seen with that signature)
+        self.processed = set()  # (path, mtime_ns, size) already measured
+        self.reference = None  # catalog or drift patch of the last measured frame
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self, directory):
+        self.stop()
+        self.directory = directory
+        self.stop_event = asyncio.Event()
+        self.task = background_tasks.create(self.run(directory, self.stop_event), name='drift monitor')
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        self.pending.clear()
+        self.reference = None
+
+    def set_method(self, method):
+        if method not in trackingerror.DRIFT_METHODS:
+            raise ValueError(f"unknown drift method {method}")
+        if method != self.method:
+            self.method = method
+            self.reference = None  # catalogs and patches can't be compared with each other
+
+    async def run(self, directory, stop_event):
+        index = dirindex.DirectoryIndex(directory)
+        try:
+            index.rescan()  # frames already there are history, only new ones are measured
+        except OSError as e:
+            print(f"unable to monitor {directory} with error {e}")
+            return
+        watcher = asyncio.ensure_future(dirindex.watch_directory(index, lambda changes: self.queue_changes(directory, changes), stop_event))
+        try:
+            while not stop_event.is_set():
+                await self.process_settled(stop_event)
+                try:
+                    await asyncio.wait_for(stop_event.wait(), self.settle_time / 2)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            stop_event.set()
+            await watcher
+
+    def queue_changes(self, directory, changes):
+        for name in changes.added + changes.modified:
+            self.pending.setdefault(os.path.join(directory, name), None)
+
+    async def process_settled(self, stop_event):
+        """Measure pending files whose size and mtime haven't changed for settle_time, oldest first."""
+        now = time.time()
+        ready = []
+        for path, seen in list(self.pending.items()):
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            signature = (file_stat.st_size, file_stat.st_mtime_ns)
+            if seen is None or seen[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - seen[1] >= self.settle_time:
+                del self.pending[path]
+                ready.append((file_stat.st_mtime, path, signature))
+        for mtime, path, signature in sorted(ready):
+            if stop_event.is_set():
+                return
+            if (path,) + signature in self.processed:
+                continue
+            self.processed.add((path,) + signature)
+            await self.measure(path, mtime)
+
+    async def measure(self, path, mtime):
+        method = self.method
+        try:
+            if method == 'phase':
+                measurement = await run.cpu_bound(trackingerror.drift_patch, path)
+            else:
+                measurement = await run.cpu_bound(trackingerror.cached_star_catalog, path)
+        except Exception as e:
+            print(f"unable to measure drift on {path} with error {e}")
+            return
+        if measurement is None or method != self.method:  # shutting down, or the method changed meanwhile
+            return
+
+        dx = dy = fwhm = float('nan')
+        stars = 0
+        reference, self.reference = self.reference, measurement
+        if method == 'phase':
+            if reference is not None and reference.shape == measurement.shape:
+                dx, dy = await run.io_bound(trackingerror.phase_correlate, reference, measurement)
+                dx *= trackingerror.DRIFT_BIN_FACTOR
+                dy *= trackingerror.DRIFT_BIN_FACTOR
+        else:
+            stars = measurement.shape[1]
+            if stars:
+                fwhm = float(np.median(measurement[3]))
+            shift = trackingerror.catalog_shift(reference, measurement) if reference is not None else None
+            if shift is not None:
+                dx, dy = shift
+
+        record = DriftRecord(path, mtime, float(dx), float(dy), fwhm, stars)
+        self.records.append(record)
+        self.on_frame(record)
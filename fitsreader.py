@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import numpy as np
+from astropy.io import fits
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Print a line with load time and peak RSS after every read, for profiling
+REPORT_LOADS = False
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def scale_raw_data(raw, header):
+    """Apply BZERO/BSCALE to a (possibly strided, memory-mapped) raw array, copying only its pixels."""
+    bscale = header.get('BSCALE', 1)
+    bzero = header.get('BZERO', 0)
+    if bscale == 1 and bzero == 0:
+        return raw.astype(raw.dtype.newbyteorder('='))
+
+    bits = raw.dtype.itemsize * 8
+    if raw.dtype.kind == 'i' and bscale == 1 and bzero == 2 ** (bits - 1):
+        # Unsigned data stored as signed integers, flipping the sign bit is the same as adding BZERO
+        unsigned = np.dtype(f'u{raw.dtype.itemsize}')
+        raw_unsigned = raw.view(raw.dtype.byteorder + unsigned.str[1:])
+        return np.bitwise_xor(raw_unsigned, 1 << (bits - 1), dtype=unsigned)
+
+    if raw.dtype.kind == 'f':
+        scaled = raw.astype(raw.dtype.newbyteorder('='))
+    else:
+        scaled = raw.astype(np.float32 if raw.dtype.itemsize <= 2 else np.float64)
+    scaled *= bscale
+    scaled += bzero
+    return scaled
+
+
+def read_fits_data(fits_file, step=1, region=None, hdu_index=0, report=None):
+    """Read image data from a FITS file, touching only the pixels that are needed.
+
+    The file is memory-mapped and sliced before anything is copied: region is an
+    optional (rows, columns) tuple of slices to crop to, and step > 1 keeps only
+    every step-th row and column. NaNs are replaced by zero for floating point
+    data only, integer data cannot contain them. report overrides REPORT_LOADS
+    for this read.
+    """
+    start_time = time.time()
+    start_rss = peak_rss_bytes()
+
+    with fits.open(fits_file, memmap=True, do_not_scale_image_data=True) as hdul:
+        hdu = hdul[hdu_index]
+        header = hdu.header
+        raw = hdu.data
+        if region is not None:
+            raw = raw[region]
+        if step > 1:
+            raw = raw[..., ::step, ::step]
+
+        data = scale_raw_data(raw, header)
+        if header['BITPIX'] < 0:
+            np.nan_to_num(data, copy=False)
+        del raw
+
+    if REPORT_LOADS if report is None else report:
+        end_rss = peak_rss_bytes()
+        rss_text = "unknown" if end_rss is None else f"{end_rss / 2**20:.0f}MB (+{(end_rss - start_rss) / 2**20:.0f}MB)"
+        print(f"loaded {os.path.basename(fits_file)} {data.shape} in {time.time() - start_time:.2f}s, peak RSS {rss_text}")
+
+    return data
@@ -0,0 +1,143 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from astropy.io import fits
+
+# Keywords kept from each primary header, in the order they are shown
+HEADER_KEYWORDS = ('DATE-OBS', 'OBJECT', 'IMAGETYP', 'FILTER', 'EXPTIME', 'GAIN', 'CCD-TEMP')
+# Capture programs don't all agree on keyword names, the first one present wins
+KEYWORD_ALIASES = {'EXPTIME': ('EXPTIME', 'EXPOSURE'), 'IMAGETYP': ('IMAGETYP', 'FRAMETYP'), 'CCD-TEMP': ('CCD-TEMP', 'CCDTEMP')}
+# Parsing a header holds the GIL, so extra threads only overlap waiting on a cold disk or network share.
+# Two keep one parsing while the other waits, more just contend (16 were slower than 1 on 2000 local files).
+HEADER_WORKERS = 2
+HEADER_BATCH_SIZE = 256
+
+
+def read_primary_header(fits_file, keywords=HEADER_KEYWORDS):
+    """keyword -> value for the keywords present in the primary header, reading only its 2880 byte blocks and never the data unit."""
+    with open(fits_file, 'rb') as file:
+        header = fits.Header.fromfile(file)
+    values = {}
+    for keyword in keywords:
+        for name in KEYWORD_ALIASES.get(keyword, (keyword,)):
+            if name in header:
+                value = header[name]
+                values[keyword] = value.strip() if isinstance(value, str) else value
+                break
+    return values
+
+
+def format_header(values):
+    """Short summary for a file browser row, e.g. "Ha 300s gain 100", or '' if the header hasn't been read yet."""
+    if not values:
+        return ''
+    parts = []
+    if 'FILTER' in values:
+        parts.append(str(values['FILTER']))
+    if 'EXPTIME' in values:
+        parts.append(f"{values['EXPTIME']:g}s" if isinstance(values['EXPTIME'], (int, float)) else str(values['EXPTIME']))
+    if 'GAIN' in values:
+        parts.append(f"gain {values['GAIN']}")
+    return ' '.join(parts)
+
+
+def sort_value(value):
+    # Headers mix numbers and strings (and some files lack a keyword), so compare numbers first, then strings
+    if isinstance(value, (int, float)):
+        return (0, value, '')
+    return (1, 0, str(value))
+
+
+def sort_by_keyword(files, headers, keyword, descending=False):
+    """files ((name, mtime) pairs) stably sorted by a header keyword, files without it last."""
+    present = [file for file in files if keyword in headers.get(file[0], {})]
+    absent = [file for file in files if keyword not in headers.get(file[0], {})]
+    present.sort(key=lambda file: sort_value(headers[file[0]][keyword]), reverse=descending)
+    return present + absent
+
+
+def group_by_keyword(files, headers, keyword):
+    """[(value, files)] with files split by their value of keyword, groups in value order, None (keyword missing) last.
+
+    Files keep their order within each group.
+    """
+    groups = {}
+    for file in files:
+        groups.setdefault(headers.get(file[0], {}).get(keyword), []).append(file)
+    values = sorted((value for value in groups if value is not None), key=sort_value)
+    if None in groups:
+        values.append(None)
+    return [(value, groups[value]) for value in values]
+
+
+class HeaderIndex:
+    """In memory cache of FITS primary header keywords, keyed by path, mtime and size.
+
+    Headers are read lazily, when the file browser shows a directory, by a
+    small pool of threads that each read just the header blocks of one file.
+    A rewritten file (different mtime or size) is read again. Files that
+    can't be parsed are remembered too, so they aren't retried until they change.
+    """
+
+    def __init__(self, workers=HEADER_WORKERS):
+        self.entries = {}  # path -> (mtime, size, keyword values or None if unreadable)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fits headers')
+        self.in_progress = set()
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def read(self, path):
+        """Read the header of path unless the cached one is current, return whether new keyword values were read."""
+        try:
+            file_stat = os.stat(path)
+        except OSError:  # deleted since it was listed
+            return False
+        with self.lock:
+            cached = self.entries.get(path)
+        if cached is not None and cached[:2] == (file_stat.st_mtime, file_stat.st_size):
+            return False
+        try:
+            values = read_primary_header(path)
+        except Exception as e:  # still being written or not a FITS file
+            print(f"unable to read FITS header of {path} with error {e}")
+            values = None
+        with self.lock:
+            self.entries[path] = (file_stat.st_mtime, file_stat.st_size, values)
+        return values is not None
+
+    async def load(self, directory, names, on_progress=None):
+        """Read the headers of the named files that aren't cached, in batches, calling on_progress with the names read in each batch that read any."""
+        paths = [os.path.join(directory, name) for name in names]
+        paths = [path for path in paths if path not in self.in_progress]
+        self.in_progress.update(paths)
+        loop = asyncio.get_running_loop()
+        try:
+            for start in range(0, len(paths), HEADER_BATCH_SIZE):
+                batch = paths[start:start + HEADER_BATCH_SIZE]
+                read = await asyncio.gather(*(loop.run_in_executor(self.executor, self.read, path) for path in batch))
+                self.in_progress.difference_update(batch)
+                if any(read) and on_progress is not None:
+                    on_progress([os.path.basename(path) for path, was_read in zip(batch, read) if was_read])
+        except RuntimeError:  # executor shut down
+            pass
+        finally:
+            self.in_progress.difference_update(paths)
+
+    def headers(self, directory, entries, sizes):
+        """name -> keyword values for the files in entries (name -> mtime) and sizes (name -> size) whose cached header matches both."""
+        headers = {}
+        with self.lock:
+            for name, mtime in entries.items():
+                cached = self.entries.get(os.path.join(directory, name))
+                if cached is not None and cached[2] is not None and cached[:2] == (mtime, sizes.get(name)):
+                    headers[name] = cached[2]
+        return headers
+
+    def unread(self, directory, entries, sizes):
+        """Names in entries with nothing cached for their current mtime and size, neither a header nor a failed read."""
+        with self.lock:
+            return [name for name, mtime in entries.items()
+                    if self.entries.get(os.path.join(directory, name), (None, None))[:2] != (mtime, sizes.get(name))]
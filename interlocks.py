@@ -0,0 +1,99 @@
+from commsmanager import MotionState
+
+
+def roof_free_to_move(lock_state):
+    # The roof can only move with the lock fully disengaged (or when the lock position is unknown)
+    return lock_state in (MotionState.LOWERED, MotionState.UNKNOWN)
+
+
+def controllable(enabled, connected):
+    # Motion commands need the enable switch on and a controller to send them to, stop is always allowed
+    return bool(enabled) and bool(connected)
+
+
+# Button -> conditions that must all hold for it to be enabled, each (inputs it reads, predicate over them).
+# Inputs: control_enabled (the enable switch), roof_state and lock_state (MotionState), connected.
+ROOF_INTERLOCKS = {
+    'raise_roof': (
+        (('control_enabled', 'connected'), controllable),
+        (('roof_state',), lambda roof_state: roof_state not in (MotionState.RAISED, MotionState.LOWERING)),
+        (('lock_state',), roof_free_to_move),
+    ),
+    'stop_roof': (),
+    'lower_roof': (
+        (('control_enabled', 'connected'), controllable),
+        (('roof_state',), lambda roof_state: roof_state not in (MotionState.LOWERED, MotionState.RAISING)),
+        (('lock_state',), roof_free_to_move),
+    ),
+    'engage_lock': (
+        (('control_enabled', 'connected'), controllable),
+        (('lock_state',), lambda lock_state: lock_state not in (MotionState.RAISED, MotionState.LOWERING)),
+    ),
+    'stop_lock': (),
+    'disengage_lock': (
+        (('control_enabled', 'connected'), controllable),
+        (('lock_state',), lambda lock_state: lock_state not in (MotionState.LOWERED, MotionState.RAISING)),
+    ),
+}
+
+
+class InterlockEngine:
+    """Evaluates an interlock table incrementally.
+
+    Every condition declares the inputs it reads. set_inputs() stores the new
+    values and re-evaluates only the rules that read an input which actually
+    changed. Results are cached, and a rule's callbacks only run when its
+    result flips, so buttons are enabled/disabled once per transition.
+    """
+
+    def __init__(self, table, **inputs):
+        self.table = table
+        self.inputs = dict(inputs)
+        self.dependents = {}  # input name -> rules reading it
+        for rule, conditions in table.items():
+            for names, _ in conditions:
+                for name in names:
+                    self.dependents.setdefault(name, []).append(rule)
+        self.results = {}
+        self.listeners = {}
+        self.evaluations = 0
+
+    def evaluate(self, rule):
+        self.evaluations += 1
+        for names, predicate in self.table[rule]:
+            if not predicate(*(self.inputs.get(name) for name in names)):
+                return False
+        return True
+
+    def result(self, rule):
+        """Cached result of a rule, evaluated on first use."""
+        if rule not in self.results:
+            self.results[rule] = self.evaluate(rule)
+        return self.results[rule]
+
+    def on_change(self, rule, callback):
+        """Call callback(result) now and whenever the rule's result changes."""
+        self.listeners.setdefault(rule, []).append(callback)
+        callback(self.result(rule))
+
+    def set_inputs(self, **inputs):
+        """Update inputs and return the rules whose result changed."""
+        dirty = []
+        for name, value in inputs.items():
+            if name in self.inputs and self.inputs[name] == value:
+                continue
+            self.inputs[name] = value
+            for rule in self.dependents.get(name, ()):
+                if rule not in dirty:
+                    dirty.append(rule)
+
+        changed = []
+        for rule in dirty:
+            result = self.evaluate(rule)
+            if self.results.get(rule) == result:
+                continue
+            self.results[rule] = result
+            changed.append(rule)
+            for callback in self.listeners.get(rule, ()):
+                callback(result)
+        return changed
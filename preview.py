@@ -0,0 +1,86 @@
+import io
+import numpy as np
+from PIL import Image
+import fitsreader
+import stretch
+
+# Width of the rendered preview in pixels
+PREVIEW_WIDTH = 900
+
+# Binned frames are kept at about this multiple of the preview width so the final resize still has detail to work with
+BIN_OVERSAMPLE = 2
+
+
+def auto_bin_factor(width, target_width=PREVIEW_WIDTH, oversample=BIN_OVERSAMPLE):
+    """Largest integer factor that keeps a frame at least oversample times the target width."""
+    return max(1, int(width // (target_width * oversample)))
+
+
+def block_bin(data, factor, method='mean'):
+    """Bin a 2D array in factor x factor blocks, dropping edge pixels that don't fill a block.
+
+    Integer data stays integer (the mean is truncated) so the binned frame can
+    still use the exact integer histogram in the stretch.
+    """
+    if factor <= 1 or data.ndim != 2:
+        return data
+    height = data.shape[0] // factor * factor
+    width = data.shape[1] // factor * factor
+    blocks = data[:height, :width].reshape(height // factor, factor, width // factor, factor)
+
+    if method == 'median':
+        binned = np.median(blocks.transpose(0, 2, 1, 3).reshape(height // factor, width // factor, -1), axis=-1)
+    elif method == 'mean':
+        if data.dtype.kind in 'iu':
+            binned = blocks.sum(axis=(1, 3), dtype=np.int64) // (factor * factor)
+        else:
+            binned = blocks.mean(axis=(1, 3), dtype=np.float32)
+    else:
+        raise ValueError(f"unknown binning method {method}")
+
+    if data.dtype.kind in 'iu':
+        return binned.astype(data.dtype)
+    return binned.astype(np.float32, copy=False)
+
+
+def render_preview(image_data, width=PREVIEW_WIDTH, bin_factor=None, bin_method='mean', clip_low=stretch.CLIP_LOW, clip_high=stretch.CLIP_HIGH, sample_size=None, exact=False):
+    """Bin, stretch and resize image data to a preview image of the given width.
+
+    bin_factor=None picks a factor automatically, 1 disables binning. exact=True
+    skips binning and uses the original stretch for byte-identical output.
+    """
+    if exact:
+        bin_factor = 1
+    elif bin_factor is None:
+        bin_factor = auto_bin_factor(image_data.shape[-1], width)
+
+    binned = block_bin(image_data, bin_factor, bin_method)
+
+    # Clip and scale to 0-255
+    image_uint8 = stretch.auto_stretch(binned, clip_low, clip_high, sample_size=sample_size, exact=exact)
+
+    # Convert to PIL image
+    image = Image.fromarray(image_uint8)
+
+    original_width, original_height = image.size
+
+    # Calculate the new height maintaining the aspect ratio
+    new_height = int(width * original_height / original_width)
+
+    # Resize the image
+    return image.resize((width, new_height), Image.LANCZOS)
+
+
+def fits_to_png(fits_image_path, read_step=1, **render_params):
+    """Render the primary HDU of a FITS file to PNG bytes.
+
+    read_step > 1 reads only every read_step-th row and column of the file.
+    """
+    image_data = fitsreader.read_fits_data(fits_image_path, step=read_step)
+
+    image = render_preview(image_data, **render_params)
+
+    # Encode the image as PNG
+    output = io.BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
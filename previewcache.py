@@ -0,0 +1,131 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Default location for rendered previews, kept across restarts of the panel
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "observatory-control-panel", "previews")
+
+
+class PreviewCache:
+    """LRU cache of rendered preview images, held in memory and mirrored on disk.
+
+    Entries are keyed by the source file's path, mtime and size plus whatever
+    render parameters produced them, so a modified file or a different stretch
+    never returns a stale preview. Both tiers are evicted by total byte size.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_memory_bytes=64 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+
+        self.memory = OrderedDict()  # key -> bytes, least recently used first
+        self.memory_bytes = 0
+        self.disk = OrderedDict()  # key -> size in bytes, least recently used first
+        self.disk_bytes = 0
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.load_disk_index()
+
+    @staticmethod
+    def make_key(path, **params):
+        """Build a cache key for a source file and the parameters used to render it."""
+        stat = os.stat(path)
+        parts = [os.path.abspath(path), stat.st_mtime_ns, stat.st_size] + sorted(params.items())
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def load_disk_index(self):
+        """Rebuild the on-disk LRU order from the files left by a previous run."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, entry.name[:-4], stat.st_size))
+        entries.sort()
+        for _, key, size in entries:
+            self.disk[key] = size
+            self.disk_bytes += size
+        self.evict_disk()
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".png")
+
+    def get(self, key):
+        """Return the cached bytes for key, or None on a miss."""
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                return data
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+
+        try:
+            with open(self.disk_path(key), "rb") as file:
+                data = file.read()
+            os.utime(self.disk_path(key))
+        except OSError:
+            with self.lock:
+                self.forget_disk(key)
+            return None
+
+        with self.lock:
+            self.store_memory(key, data)
+        return data
+
+    def put(self, key, data):
+        """Add rendered bytes to both tiers, evicting old entries as needed."""
+        with self.lock:
+            self.store_memory(key, data)
+            if self.cache_dir is None or key in self.disk:
+                return
+
+        try:
+            tmp_path = self.disk_path(key) + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, self.disk_path(key))
+        except OSError as e:
+            print(f"unable to write preview cache entry with error {e}")
+            return
+
+        with self.lock:
+            self.disk[key] = len(data)
+            self.disk_bytes += len(data)
+            self.evict_disk()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.memory or key in self.disk
+
+    def store_memory(self, key, data):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        if len(data) > self.max_memory_bytes:
+            return
+        self.memory[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def forget_disk(self, key):
+        size = self.disk.pop(key, None)
+        if size is not None:
+            self.disk_bytes -= size
+
+    def evict_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self.disk_path(key))
+            except OSError:
+                pass
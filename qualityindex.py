@@ -0,0 +1,149 @@
+import os
+import asyncio
+import sqlite3
+from contextlib import closing
+import numpy as np
+from nicegui import run
+import trackingerror
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "observatory-control-panel", "quality.sqlite3")
+
+# Per frame metrics, each with an index so ranking a directory by any of them doesn't scan the table
+QUALITY_COLUMNS = ('fwhm', 'eccentricity', 'stars', 'background')
+# Each worker holds a full frame while measuring it, and the pool is shared with preview rendering,
+# so the indexer only uses half of it
+QUALITY_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+# Up to this many files are looked up by name (e.g. one batch of file events), more read the whole directory's rows
+NAME_LOOKUP_LIMIT = 500
+
+
+def frame_quality(fits_file):
+    """(fwhm, eccentricity, stars, background) of a frame: median star shape and sky level from the cached star catalog.
+
+    A cache hit doesn't read the frame at all, a miss loads it once. Detection
+    runs on one thread, the frames are already spread over the process pool.
+    """
+    catalog, (background, _) = trackingerror.cached_star_catalog_with_background(fits_file, workers=1)
+    if catalog.shape[1] == 0:
+        return None, None, 0, float(background)
+    return float(np.median(catalog[3])), float(np.median(catalog[4])), int(catalog.shape[1]), float(background)
+
+
+def format_quality(metrics):
+    """Short summary for a file browser row, or '' if the frame hasn't been measured yet."""
+    if metrics is None:
+        return ''
+    fwhm, eccentricity, stars, background = metrics
+    if stars is None:
+        return "unable to measure"
+    if not stars:
+        return f"no stars, bg {background:.0f}"
+    return f"FWHM {fwhm:.2f} e {eccentricity:.2f} {stars}★ bg {background:.0f}"
+
+
+class QualityIndex:
+    """SQLite index of frame quality metrics, keyed by directory, file name and mtime.
+
+    Frames are measured once in the NiceGUI process pool, reusing the on disk
+    star catalogs from trackingerror. A row is only valid while the file's
+    mtime matches, so a rewritten frame is measured again. Frames that can't
+    be measured get a row of NULLs, so they aren't retried until they change.
+    Sorting and filtering by a metric is an ORDER BY on an index instead of
+    loading FITS.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, workers=QUALITY_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self.in_progress = set()  # paths being measured right now
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self.connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS frames ("
+                "directory TEXT, name TEXT, mtime REAL, "
+                "fwhm REAL, eccentricity REAL, stars INTEGER, background REAL, "
+                "PRIMARY KEY (directory, name)) WITHOUT ROWID")
+            for column in QUALITY_COLUMNS:
+                connection.execute(f"CREATE INDEX IF NOT EXISTS frames_{column} ON frames (directory, {column})")
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def rows(self, directory, entries, columns):
+        """Rows of name, mtime and columns stored for the files in entries, looked up by name when there are only a few."""
+        query = f"SELECT name, mtime{''.join(', ' + column for column in columns)} FROM frames WHERE directory = ?"
+        directory = os.path.abspath(directory)
+        with closing(self.connect()) as connection:
+            if len(entries) > NAME_LOOKUP_LIMIT:
+                return connection.execute(query, (directory,)).fetchall()
+            names = list(entries)
+            return connection.execute(f"{query} AND name IN ({', '.join('?' * len(names))})", [directory] + names).fetchall()
+
+    def metrics(self, directory, entries):
+        """name -> (fwhm, eccentricity, stars, background) for the files in entries (name -> mtime) measured at their current mtime.
+
+        Frames that couldn't be measured are all None.
+        """
+        rows = self.rows(directory, entries, QUALITY_COLUMNS)
+        return {row[0]: row[2:] for row in rows if entries.get(row[0]) == row[1]}
+
+    def query(self, directory, entries, sort_key='fwhm', descending=False, max_fwhm=None, min_stars=None):
+        """(name, mtime) of the measured files in entries, sorted by a quality column and optionally filtered on FWHM and star count."""
+        if sort_key not in QUALITY_COLUMNS:
+            raise ValueError(f"unknown quality column {sort_key}")
+        conditions = ["directory = ?"]
+        params = [os.path.abspath(directory)]
+        if max_fwhm is not None:
+            conditions.append("fwhm <= ?")
+            params.append(max_fwhm)
+        if min_stars is not None:
+            conditions.append("stars >= ?")
+            params.append(min_stars)
+        # Frames without stars have no FWHM and always sort last
+        order = f"{sort_key} IS NULL, {sort_key} {'DESC' if descending else 'ASC'}"
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                f"SELECT name, mtime FROM frames WHERE {' AND '.join(conditions)} ORDER BY {order}", params).fetchall()
+        return [(name, mtime) for name, mtime in rows if entries.get(name) == mtime]
+
+    def missing(self, directory, entries):
+        """Names in entries with no row for their current mtime."""
+        stored = dict(self.rows(directory, entries, ()))
+        return [name for name, mtime in entries.items() if stored.get(name) != mtime]
+
+    def store(self, directory, rows):
+        """Write (name, mtime, fwhm, eccentricity, stars, background) rows in one transaction."""
+        directory = os.path.abspath(directory)
+        try:
+            with closing(self.connect()) as connection, connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(directory,) + tuple(row) for row in rows])
+        except sqlite3.Error as e:
+            print(f"unable to store frame quality with error {e}")
+
+    async def index_directory(self, directory, entries, on_progress=None):
+        """Measure every file in entries that isn't indexed yet, newest first, calling on_progress with the names in each batch."""
+        names = sorted(self.missing(directory, entries), key=lambda name: entries[name], reverse=True)
+        paths = [os.path.join(directory, name) for name in names]
+        pending = [(name, path) for name, path in zip(names, paths) if path not in self.in_progress]
+        self.in_progress.update(path for _, path in pending)
+        try:
+            for start in range(0, len(pending), self.workers):
+                batch = pending[start:start + self.workers]
+                results = await asyncio.gather(*(run.cpu_bound(frame_quality, path) for _, path in batch), return_exceptions=True)
+                rows = []
+                for (name, path), result in zip(batch, results):
+                    self.in_progress.discard(path)
+                    if result is None:  # the app is shutting down
+                        return
+                    if isinstance(result, Exception):
+                        print(f"unable to measure {path} with error {result}")
+                        result = (None, None, None, None)
+                    rows.append((name, entries[name]) + result)
+                self.store(directory, rows)
+                if on_progress is not None:
+                    on_progress([name for name, _ in batch])
+        finally:
+            self.in_progress.difference_update(path for _, path in pending)
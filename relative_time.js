@@ -0,0 +1,37 @@
+// One shared tick refreshes every relative time label on the page
+const labels = new Set();
+setInterval(() => {
+  const now = Date.now();
+  labels.forEach((label) => (label.now = now));
+}, 1000);
+
+export default {
+  template: `<span>{{ text }}</span>`,
+  props: {
+    timestamp: Number,
+  },
+  data() {
+    return {
+      now: Date.now(),
+    };
+  },
+  mounted() {
+    labels.add(this);
+  },
+  unmounted() {
+    labels.delete(this);
+  },
+  computed: {
+    text() {
+      // Timestamps come from the server's clock, the server sends its time to this browser on connect
+      const skew = window.relative_time_skew || 0;
+      const seconds = (this.now + skew) / 1000 - this.timestamp;
+      if (seconds < 60) return `${Math.trunc(seconds)} seconds ago`;
+      const minutes = seconds / 60;
+      if (minutes < 60) return `${Math.trunc(minutes)} minutes ago`;
+      const hours = minutes / 60;
+      if (hours < 24) return `${Math.trunc(hours)} hours ago`;
+      return `${Math.trunc(hours / 24)} days ago`;
+    },
+  },
+};
@@ -0,0 +1,137 @@
+import numpy as np
+
+# Default clipping points (0.25% and 99.75% of the pixel distribution)
+CLIP_LOW = 0.0025
+CLIP_HIGH = 0.9975
+
+# Number of pixels histogrammed at a time, bounds the temporary memory used by bincount
+CHUNK_PIXELS = 1 << 22
+
+# Bin count used for float data, matches the resolution of the 16-bit integer path
+FLOAT_BINS = 65536
+
+
+def stratified_sample(data, sample_size):
+    """Take roughly sample_size pixels, one from the centre of each cell of a regular grid."""
+    if sample_size is None or data.size <= sample_size:
+        return data
+    if data.ndim < 2:
+        step = int(np.ceil(data.size / sample_size))
+        return data[step // 2::step]
+    step = int(np.ceil(np.sqrt(data.shape[-2] * data.shape[-1] / sample_size)))
+    return data[..., step // 2::step, step // 2::step]
+
+
+def iter_chunks(data):
+    flat = data.reshape(-1) if data.flags.c_contiguous else None
+    if flat is not None:
+        for start in range(0, flat.size, CHUNK_PIXELS):
+            yield flat[start:start + CHUNK_PIXELS]
+        return
+    # Strided views (e.g. subsamples) are walked row by row to avoid a full copy
+    rows = data.reshape(-1, data.shape[-1]) if data.ndim > 1 else data.reshape(1, -1)
+    rows_per_chunk = max(1, CHUNK_PIXELS // max(1, rows.shape[1]))
+    for start in range(0, rows.shape[0], rows_per_chunk):
+        yield rows[start:start + rows_per_chunk].ravel()
+
+
+def integer_histogram(data):
+    """Return (counts, offset) for integer data of 16 bits or fewer, counts[i] is the number of pixels equal to i + offset."""
+    offset = 0
+    if data.dtype.kind == 'i':
+        offset = int(np.iinfo(data.dtype).min)
+    counts = np.zeros(1 << (8 * data.dtype.itemsize), dtype=np.int64)
+    for chunk in iter_chunks(data):
+        if offset:
+            chunk = chunk.astype(np.int32) - offset
+        counts += np.bincount(chunk, minlength=counts.size)
+    return counts, offset
+
+
+def float_histogram(data, bins=FLOAT_BINS):
+    """Return (counts, bin_edges) over the finite range of the data using fixed-width bins."""
+    low = np.inf
+    high = -np.inf
+    for chunk in iter_chunks(data):
+        finite = chunk[np.isfinite(chunk)]
+        if finite.size:
+            low = min(low, float(finite.min()))
+            high = max(high, float(finite.max()))
+    if not np.isfinite(low):
+        low, high = 0.0, 0.0
+    if high <= low:
+        high = low + 1.0
+
+    counts = np.zeros(bins, dtype=np.int64)
+    for chunk in iter_chunks(data):
+        chunk_counts, bin_edges = np.histogram(chunk, bins=bins, range=(low, high))
+        counts += chunk_counts
+    return counts, np.linspace(low, high, bins + 1)
+
+
+def compute_stretch_limits(data, clip_low=CLIP_LOW, clip_high=CLIP_HIGH, sample_size=None):
+    """Return the data values below which clip_low and clip_high of the pixels fall.
+
+    16-bit (or smaller) integer data is counted exactly with bincount, anything
+    else with a fixed-bin histogram. If sample_size is given, the limits are
+    estimated from a stratified subsample of about that many pixels.
+    """
+    sample = stratified_sample(data, sample_size)
+
+    if sample.dtype.kind in 'iub' and sample.dtype.itemsize <= 2:
+        counts, offset = integer_histogram(sample.view(np.uint8) if sample.dtype.kind == 'b' else sample)
+        cdf = counts.cumsum()
+        if cdf[-1] == 0:
+            return 0.0, 0.0
+        low = np.searchsorted(cdf, clip_low * cdf[-1])
+        high = np.searchsorted(cdf, clip_high * cdf[-1])
+        return float(low + offset), float(high + offset)
+
+    counts, bin_edges = float_histogram(sample)
+    cdf = counts.cumsum()
+    if cdf[-1] == 0:
+        return 0.0, 0.0
+    low = np.searchsorted(cdf, clip_low * cdf[-1])
+    high = np.searchsorted(cdf, clip_high * cdf[-1])
+    return float(bin_edges[low]), float(bin_edges[high])
+
+
+def apply_stretch(data, low, high):
+    """Linearly map [low, high] to 0-255, working in a single float32 buffer."""
+    scaled = np.empty(data.shape, dtype=np.float32)
+    np.subtract(data, np.float32(low), out=scaled, dtype=np.float32, casting='unsafe')
+    scale = 255 / (high - low) if high > low else 0
+    np.multiply(scaled, np.float32(scale), out=scaled)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def legacy_stretch(image_data, clip_low=CLIP_LOW, clip_high=CLIP_HIGH):
+    """The original full-frame np.histogram(bins='auto') stretch, kept for regression comparisons."""
+    # Calculate the histogram of the image data
+    histogram, bin_edges = np.histogram(image_data.flatten(), bins='auto', density=True)
+
+    # Compute cumulative distribution from the histogram
+    cdf = histogram.cumsum()
+    cdf_normalized = cdf / cdf[-1]  # Normalize
+
+    # Determine clipping points
+    cdf_min = np.searchsorted(cdf_normalized, clip_low)
+    cdf_max = np.searchsorted(cdf_normalized, clip_high)
+
+    # Clip the image data to these points and scale to 0-255
+    clipped_data = np.clip(image_data, bin_edges[cdf_min], bin_edges[cdf_max])
+    scaled_data = (clipped_data - bin_edges[cdf_min]) / (bin_edges[cdf_max] - bin_edges[cdf_min]) * 255
+    return scaled_data.astype(np.uint8)
+
+
+def auto_stretch(image_data, clip_low=CLIP_LOW, clip_high=CLIP_HIGH, sample_size=None, exact=False):
+    """Stretch image data to uint8 for display.
+
+    With exact=True the original algorithm is used so output is byte-for-byte
+    identical to previous releases.
+    """
+    if exact:
+        return legacy_stretch(image_data, clip_low, clip_high)
+    low, high = compute_stretch_limits(image_data, clip_low, clip_high, sample_size)
+    return apply_stretch(image_data, low, high)
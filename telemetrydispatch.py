@@ -0,0 +1,73 @@
+class TelemetryDispatcher:
+    """Pushes telemetry to widgets only when the fields they show change.
+
+    Sources are SerialManagers. dispatch() reads each one's latest packet,
+    diffs it against the previous snapshot and calls every subscriber watching
+    a changed field once, with the current raw values of its fields. The
+    connection state is tracked as an extra 'connected' field, so widgets that
+    show placeholders while disconnected are refreshed when it changes.
+
+    One dispatcher serves every connected client. Subscriptions made with an
+    owner element are dropped once that element is deleted, e.g. when a
+    per-client page is closed.
+    """
+
+    def __init__(self):
+        self.sources = {}  # name -> (manager, field names, last packet, last values)
+        self.subscriptions = {}  # (source, field) -> subscriptions watching it
+        self.pending = []  # new subscriptions, called on the next dispatch whatever changed
+
+    def add_source(self, name, manager):
+        names = manager.last_data.NAMES + ('connected',)
+        self.sources[name] = (manager, names, None, None)
+
+    def subscribe(self, source, fields, callback, owner=None):
+        """Call callback(*values) with the raw values of fields whenever any of them changes."""
+        manager, names = self.sources[source][:2]
+        subscription = (source, tuple(names.index(field) for field in fields), callback, owner)
+        for field in fields:
+            self.subscriptions.setdefault((source, field), []).append(subscription)
+        self.pending.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for subscriptions in self.subscriptions.values():
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+        if subscription in self.pending:
+            self.pending.remove(subscription)
+
+    def dispatch(self):
+        """Diff every source against its previous snapshot and notify subscribers of changed fields."""
+        due = self.pending
+        self.pending = []
+        values_by_source = {}
+        for name, (manager, names, last_packet, last_values) in self.sources.items():
+            packet = manager.last_data
+            connected = manager.connected
+            # last_data is replaced per packet, so an unchanged object means nothing new arrived
+            if packet is last_packet and last_values is not None and last_values[-1] == connected:
+                values_by_source[name] = last_values
+                continue
+            values = (packet.values if connected else manager.zero_data().values) + (connected,)
+            self.sources[name] = (manager, names, packet, values)
+            values_by_source[name] = values
+            if last_values is None:
+                changed = names
+            else:
+                changed = [field for field, old, new in zip(names, last_values, values) if old != new]
+            for field in changed:
+                for subscription in self.subscriptions.get((name, field), ()):
+                    if subscription not in due:
+                        due.append(subscription)
+
+        for subscription in due:
+            source, indices, callback, owner = subscription
+            if owner is not None and owner.is_deleted:
+                self.unsubscribe(subscription)
+                continue
+            values = values_by_source[source]
+            try:
+                callback(*(values[index] for index in indices))
+            except Exception as e:
+                print(f"telemetry subscriber failed with error {e}")
@@ -0,0 +1,112 @@
+import struct
+import threading
+import numpy as np
+
+# struct format characters used by the controllers and their NumPy equivalents (native byte order, like struct.unpack)
+STRUCT_TO_NUMPY = {
+    'f': '=f4',
+    'd': '=f8',
+    'B': 'u1',
+    'b': 'i1',
+    'H': '=u2',
+    'h': '=i2',
+    'I': '=u4',
+    'i': '=i4',
+}
+
+
+def packet_dtype(struct_format, names):
+    """Structured dtype laid out exactly like a packet decoded with struct_format, with the given field names."""
+    formats = [STRUCT_TO_NUMPY[code] for code in struct_format]
+    offsets = []
+    for i in range(len(struct_format)):
+        offsets.append(struct.calcsize(struct_format[:i + 1]) - struct.calcsize(struct_format[i]))
+    return np.dtype({'names': list(names), 'formats': formats, 'offsets': offsets, 'itemsize': struct.calcsize(struct_format)})
+
+
+class TelemetryHistory:
+    """Fixed-size ring buffer holding every packet from one controller, timestamped, in a NumPy structured array.
+
+    Packets are copied in as raw bytes, so recording costs no Python objects per
+    sample. Readers get chronological copies and can compute stats per field.
+    """
+
+    def __init__(self, struct_format, names, capacity=36000):
+        payload = packet_dtype(struct_format, names)
+        self.fields = list(names)
+        self.payload_size = payload.itemsize
+        # Timestamp first, then the packet bytes unchanged
+        self.dtype = np.dtype({
+            'names': ['timestamp'] + self.fields,
+            'formats': ['=f8'] + [payload.fields[name][0] for name in self.fields],
+            'offsets': [0] + [8 + payload.fields[name][1] for name in self.fields],
+            'itemsize': 8 + payload.itemsize,
+        })
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=self.dtype)
+        self.raw = self.data.view(np.uint8).reshape(capacity, self.dtype.itemsize)
+        self.count = 0  # total packets ever appended
+        self.lock = threading.Lock()
+
+    def append_packet(self, timestamp, payload):
+        """Record one packet payload (sync pattern stripped) received at timestamp."""
+        with self.lock:
+            index = self.count % self.capacity
+            self.raw[index, 8:] = np.frombuffer(payload, dtype=np.uint8, count=self.payload_size)
+            self.data['timestamp'][index] = timestamp
+            self.count += 1
+
+    def append_packets(self, timestamp, payloads):
+        """Record a batch of packet payloads received together, decoded in one np.frombuffer call."""
+        if len(payloads) > self.capacity:
+            payloads = payloads[-self.capacity:]
+        batch = np.frombuffer(b"".join(payloads), dtype=np.uint8).reshape(len(payloads), self.payload_size)
+        with self.lock:
+            start = self.count % self.capacity
+            first = min(len(payloads), self.capacity - start)
+            self.raw[start:start + first, 8:] = batch[:first]
+            self.data['timestamp'][start:start + first] = timestamp
+            rest = len(payloads) - first
+            if rest:
+                self.raw[:rest, 8:] = batch[first:]
+                self.data['timestamp'][:rest] = timestamp
+            self.count += len(payloads)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def latest(self, n=None):
+        """Copy of the last n packets (all stored packets by default), oldest first."""
+        with self.lock:
+            return self.copy_latest(n)
+
+    def packets_after(self, count):
+        """Packets appended after the first count, oldest first, and the count to pass next time.
+
+        Packets that were already overwritten are skipped, so a slow reader loses
+        data rather than holding up the reader thread.
+        """
+        with self.lock:
+            return self.copy_latest(max(0, self.count - count)), self.count
+
+    def copy_latest(self, n=None):
+        # Callers must hold self.lock
+        stored = min(self.count, self.capacity)
+        n = stored if n is None else min(n, stored)
+        end = self.count % self.capacity
+        if n <= end:
+            return self.data[end - n:end].copy()
+        return np.concatenate((self.data[self.capacity - (n - end):], self.data[:end]))
+
+    def since(self, timestamp):
+        """Copy of every stored packet received at or after timestamp, oldest first."""
+        packets = self.latest()
+        return packets[np.searchsorted(packets['timestamp'], timestamp):]
+
+    def stats(self, field, since=None):
+        """min/max/mean of one field over the stored packets (optionally only those since a timestamp)."""
+        packets = self.latest() if since is None else self.since(since)
+        values = packets[field]
+        if values.size == 0:
+            return dict(count=0, min=None, max=None, mean=None)
+        return dict(count=int(values.size), min=float(values.min()), max=float(values.max()), mean=float(values.mean()))
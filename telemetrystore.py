@@ -0,0 +1,153 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+import numpy as np
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "observatory-control-panel", "telemetry.sqlite3")
+
+# Rollup bucket sizes in seconds
+ROLLUP_RESOLUTIONS = (1, 60, 3600)
+
+
+class TelemetryStore:
+    """Append-only SQLite store for controller telemetry with precomputed min/max/mean rollups.
+
+    Channels are TelemetryHistory ring buffers. A background thread copies new
+    packets out of them every flush_interval seconds and writes each batch in a
+    single transaction: the raw samples, plus 1s, 1min and 1h rollups of every
+    float field, merged into existing buckets with an upsert. Queries over long
+    ranges read the rollups instead of scanning raw samples.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, flush_interval=5, raw_retention_days=7):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.raw_retention_days = raw_retention_days
+        self.channels = {}  # name -> (history, rollup fields, count already stored)
+        self.stopping = threading.Event()  # set to wake the writer for a final flush
+        self.writer = None
+        self.last_prune = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self.connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rollups ("
+                "channel TEXT, field TEXT, resolution INTEGER, bucket REAL, "
+                "min REAL, max REAL, sum REAL, count INTEGER, "
+                "PRIMARY KEY (channel, field, resolution, bucket)) WITHOUT ROWID")
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def add_channel(self, name, history):
+        """Record every packet of a TelemetryHistory under name, with rollups of its float fields."""
+        rollup_fields = [field for field in history.fields if history.dtype.fields[field][0].kind == 'f']
+        columns = ", ".join(f"{field} REAL" for field in history.fields)
+        with closing(self.connect()) as connection, connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS raw_{name} (timestamp REAL, {columns})")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS raw_{name}_timestamp ON raw_{name} (timestamp)")
+        with self.lock:
+            self.channels[name] = (history, rollup_fields, history.count)
+
+    def start(self):
+        if self.writer is not None:
+            return
+        self.stopping.clear()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True, name="telemetry store")
+        self.writer.start()
+
+    def stop(self):
+        # The writer wakes up immediately, so this only waits for the final flush
+        self.stopping.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    def write_loop(self):
+        connection = self.connect()
+        try:
+            while not self.stopping.wait(self.flush_interval):
+                self.flush(connection)
+            self.flush(connection)
+        finally:
+            connection.close()
+
+    def flush(self, connection):
+        """Write everything recorded since the last flush in one transaction."""
+        batches = []
+        with self.lock:
+            for name, (history, rollup_fields, stored_count) in self.channels.items():
+                packets, count = history.packets_after(stored_count)
+                self.channels[name] = (history, rollup_fields, count)
+                if len(packets):
+                    batches.append((name, history.fields, rollup_fields, packets))
+        if not batches:
+            return
+
+        try:
+            with connection:
+                for name, fields, rollup_fields, packets in batches:
+                    placeholders = ", ".join("?" * (len(fields) + 1))
+                    rows = np.column_stack([packets['timestamp']] + [packets[field].astype(np.float64) for field in fields])
+                    connection.executemany(f"INSERT INTO raw_{name} VALUES ({placeholders})", rows.tolist())
+                    connection.executemany(
+                        "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (channel, field, resolution, bucket) DO UPDATE SET "
+                        "min = min(min, excluded.min), max = max(max, excluded.max), "
+                        "sum = sum + excluded.sum, count = count + excluded.count",
+                        compute_rollups(name, packets, rollup_fields))
+                if time.time() - self.last_prune > 3600:
+                    self.prune_raw(connection)
+        except sqlite3.Error as e:
+            print(f"unable to write telemetry with error {e}")
+
+    def prune_raw(self, connection):
+        """Drop raw samples older than the retention period, rollups are kept forever."""
+        self.last_prune = time.time()
+        cutoff = self.last_prune - self.raw_retention_days * 86400
+        for name in self.channels:
+            connection.execute(f"DELETE FROM raw_{name} WHERE timestamp < ?", (cutoff,))
+
+    def query(self, channel, field, start, end=None, resolution=None, max_points=2000):
+        """Return (timestamps, mins, maxs, means) for a field between start and end.
+
+        resolution is a rollup size in seconds or 0 for raw samples. By default
+        the finest resolution giving at most max_points buckets is used.
+        """
+        end = time.time() if end is None else end
+        if resolution is None:
+            resolution = next((r for r in ROLLUP_RESOLUTIONS if (end - start) / r <= max_points), ROLLUP_RESOLUTIONS[-1])
+        with closing(self.connect()) as connection:
+            if resolution == 0:
+                rows = connection.execute(
+                    f"SELECT timestamp, {field}, {field}, {field} FROM raw_{channel} WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp",
+                    (start, end)).fetchall()
+            else:
+                rows = connection.execute(
+                    "SELECT bucket, min, max, sum / count FROM rollups "
+                    "WHERE channel = ? AND field = ? AND resolution = ? AND bucket BETWEEN ? AND ? ORDER BY bucket",
+                    (channel, field, resolution, start - resolution, end)).fetchall()
+        if not rows:
+            return tuple(np.array([]) for _ in range(4))
+        return tuple(np.array(column, dtype=np.float64) for column in zip(*rows))
+
+
+def compute_rollups(channel, packets, fields):
+    """Rollup rows (channel, field, resolution, bucket, min, max, sum, count) for a batch of packets in time order."""
+    rows = []
+    timestamps = packets['timestamp']
+    for resolution in ROLLUP_RESOLUTIONS:
+        buckets = np.floor(timestamps / resolution) * resolution
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        counts = np.diff(np.r_[starts, len(buckets)])
+        for field in fields:
+            values = packets[field].astype(np.float64)
+            mins = np.minimum.reduceat(values, starts)
+            maxs = np.maximum.reduceat(values, starts)
+            sums = np.add.reduceat(values, starts)
+            for bucket, low, high, total, count in zip(buckets[starts], mins, maxs, sums, counts):
+                rows.append((channel, field, resolution, float(bucket), float(low), float(high), float(total), int(count)))
+    return rows
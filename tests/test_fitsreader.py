@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+import fitsreader
+
+
+def test_unscaled_data_is_native_byte_order():
+    raw = np.array([[1, 2], [3, 4]], dtype='>i2')
+    data = fitsreader.scale_raw_data(raw, {})
+    assert data.dtype == np.int16
+    assert data.dtype.byteorder in '=|'
+    assert data.tolist() == raw.tolist()
+
+
+def test_unsigned_16_bit_flips_the_sign_bit():
+    raw = np.array([[-32768, -1, 0, 32767]], dtype='>i2')
+    data = fitsreader.scale_raw_data(raw, {'BZERO': 32768, 'BSCALE': 1})
+    assert data.dtype == np.uint16
+    assert data.tolist() == [[0, 32767, 32768, 65535]]
+
+
+def test_integer_scaling_is_float32():
+    raw = np.array([[0, 1, -2]], dtype='>i2')
+    data = fitsreader.scale_raw_data(raw, {'BZERO': 1000, 'BSCALE': 2})
+    assert data.dtype == np.float32
+    assert data.tolist() == [[1000, 1002, 996]]
+
+
+def test_32_bit_integer_scaling_is_float64():
+    raw = np.array([[2 ** 30]], dtype='>i4')
+    data = fitsreader.scale_raw_data(raw, {'BZERO': 0.5, 'BSCALE': 1})
+    assert data.dtype == np.float64
+    assert data.tolist() == [[2 ** 30 + 0.5]]
+
+
+@pytest.mark.parametrize('dtype', ['>f4', '>f8'])
+def test_float_data_is_scaled_at_its_own_precision(dtype):
+    raw = np.array([[93.1, -1.5]], dtype=dtype)
+    data = fitsreader.scale_raw_data(raw, {'BZERO': 1000, 'BSCALE': 2})
+    assert data.dtype == np.dtype(dtype).newbyteorder('=')
+    np.testing.assert_allclose(data, [[1186.2, 997]], rtol=1e-6)
+
+
+def test_scaling_a_strided_view_keeps_its_shape():
+    raw = np.arange(64, dtype='>i2').reshape(8, 8)[::2, 1::3]
+    data = fitsreader.scale_raw_data(raw, {'BZERO': 10, 'BSCALE': 1})
+    assert data.tolist() == (raw.astype(np.float32) + 10).tolist()
+
+
+@pytest.mark.parametrize('values', [
+    np.arange(12, dtype=np.uint16).reshape(3, 4) * 5000,
+    np.arange(12, dtype=np.int16).reshape(3, 4) - 6,
+    np.linspace(-1, 1, 12, dtype=np.float32).reshape(3, 4),
+])
+def test_read_matches_astropy(tmp_path, values):
+    path = str(tmp_path / "frame.fits")
+    fits.PrimaryHDU(values).writeto(path)
+    expected = fits.getdata(path)
+    assert np.array_equal(fitsreader.read_fits_data(path), expected)
+    assert np.array_equal(fitsreader.read_fits_data(path, step=2, region=(slice(1, 3), slice(None))), expected[1:3][::2, ::2])
+
+
+def test_read_applies_float_bzero_and_replaces_nans(tmp_path):
+    path = str(tmp_path / "frame.fits")
+    hdu = fits.PrimaryHDU(np.array([[93.1, np.nan]], dtype=np.float32))
+    hdu.header['BZERO'] = 1000
+    hdu.writeto(path)
+    np.testing.assert_allclose(fitsreader.read_fits_data(path), [[1093.1, 0]], rtol=1e-6)
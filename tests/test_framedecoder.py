@@ -0,0 +1,51 @@
+from commsmanager import FrameDecoder, sync_pattern
+
+PACKET_SIZE = len(sync_pattern) + 4
+
+
+def packet(payload):
+    return sync_pattern + payload
+
+
+def test_whole_packets():
+    decoder = FrameDecoder(PACKET_SIZE)
+    assert decoder.feed(packet(b'abcd') + packet(b'efgh')) == [b'abcd', b'efgh']
+    assert decoder.buffer == bytearray()
+
+
+def test_any_chunking_gives_the_same_payloads():
+    stream = b'\x00\x01' + packet(b'abcd') + packet(b'efgh') + b'\x02' + packet(b'ijkl')
+    for chunk_size in range(1, len(stream) + 1):
+        decoder = FrameDecoder(PACKET_SIZE)
+        payloads = []
+        for start in range(0, len(stream), chunk_size):
+            payloads += decoder.feed(stream[start:start + chunk_size])
+        assert payloads == [b'abcd', b'efgh', b'ijkl'], chunk_size
+
+
+def test_resyncs_after_garbage():
+    decoder = FrameDecoder(PACKET_SIZE)
+    assert decoder.feed(b'\x13\x37\x00') == []
+    assert decoder.feed(packet(b'abcd')) == [b'abcd']
+    assert decoder.buffer == bytearray()
+
+
+def test_partial_sync_pattern_is_kept():
+    decoder = FrameDecoder(PACKET_SIZE)
+    assert decoder.feed(b'junk' + sync_pattern[:2]) == []
+    assert decoder.buffer == bytearray(sync_pattern[:2])
+    assert decoder.feed(sync_pattern[2:] + b'abcd') == [b'abcd']
+
+
+def test_checksum_rejects_false_sync():
+    # Payloads end in a 0xff marker byte, a false sync inside a payload doesn't
+    decoder = FrameDecoder(PACKET_SIZE, checksum=lambda data: data[-1] == 0xff)
+    stream = sync_pattern + b'\x50' + sync_pattern + b'\xff'
+    assert decoder.feed(stream) == [sync_pattern + b'\xff']
+
+
+def test_buffer_is_bounded():
+    decoder = FrameDecoder(64, max_buffer_size=16)
+    assert decoder.feed(sync_pattern + bytes(40)) == []
+    assert len(decoder.buffer) == 16
+    assert decoder.dropped_bytes == len(sync_pattern) + 40 - 16
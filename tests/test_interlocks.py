@@ -0,0 +1,61 @@
+import pytest
+
+from commsmanager import MotionState
+from interlocks import ROOF_INTERLOCKS, InterlockEngine
+
+
+def engine(**inputs):
+    defaults = dict(control_enabled=True, connected=True, roof_state=MotionState.LOWERED, lock_state=MotionState.LOWERED)
+    defaults.update(inputs)
+    return InterlockEngine(ROOF_INTERLOCKS, **defaults)
+
+
+def results(engine):
+    return {rule: engine.result(rule) for rule in ROOF_INTERLOCKS}
+
+
+def test_closed_and_unlocked_roof_can_only_be_raised():
+    assert results(engine()) == {'raise_roof': True, 'stop_roof': True, 'lower_roof': False,
+                                 'engage_lock': True, 'stop_lock': True, 'disengage_lock': False}
+
+
+@pytest.mark.parametrize('inputs', [dict(control_enabled=False), dict(connected=False)])
+def test_motion_needs_control_enabled_and_a_connection(inputs):
+    assert results(engine(**inputs)) == {'raise_roof': False, 'stop_roof': True, 'lower_roof': False,
+                                         'engage_lock': False, 'stop_lock': True, 'disengage_lock': False}
+
+
+@pytest.mark.parametrize('lock_state', [MotionState.RAISED, MotionState.RAISING, MotionState.LOWERING])
+def test_roof_cannot_move_unless_the_lock_is_disengaged(lock_state):
+    interlocks = engine(roof_state=MotionState.RAISED, lock_state=lock_state)
+    assert not interlocks.result('lower_roof')
+    assert interlocks.result('stop_roof')
+
+
+def test_roof_cannot_reverse_while_moving():
+    interlocks = engine(roof_state=MotionState.RAISING)
+    assert interlocks.result('raise_roof')
+    assert not interlocks.result('lower_roof')
+
+
+def test_only_flipped_rules_are_reported_and_notified():
+    interlocks = engine()
+    calls = []
+    for rule in ROOF_INTERLOCKS:
+        interlocks.on_change(rule, lambda result, rule=rule: calls.append((rule, result)))
+    calls.clear()
+
+    assert interlocks.set_inputs(connected=False) == ['raise_roof', 'engage_lock']
+    assert calls == [('raise_roof', False), ('engage_lock', False)]
+    calls.clear()
+    assert interlocks.set_inputs(connected=False) == []
+    assert calls == []
+
+
+def test_only_rules_reading_a_changed_input_are_evaluated():
+    interlocks = engine()
+    results(interlocks)
+    evaluations = interlocks.evaluations
+    interlocks.set_inputs(roof_state=MotionState.RAISING)
+    # roof_state is only read by raise_roof and lower_roof
+    assert interlocks.evaluations - evaluations == 2
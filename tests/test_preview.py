@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import preview
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int32])
+def test_integer_mean_bin_keeps_dtype(dtype):
+    data = np.arange(36, dtype=dtype).reshape(6, 6)
+    binned = preview.block_bin(data, 2)
+    assert binned.dtype == dtype
+    # Top left block is 0, 1, 6, 7, the integer mean truncates 3.5 to 3
+    assert binned[0, 0] == 3
+    assert binned.shape == (3, 3)
+
+
+def test_mean_bin_does_not_overflow():
+    data = np.full((4, 4), 65535, dtype=np.uint16)
+    assert preview.block_bin(data, 4).tolist() == [[65535]]
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_float_bin_is_float32(dtype):
+    data = np.arange(16, dtype=dtype).reshape(4, 4)
+    binned = preview.block_bin(data, 2)
+    assert binned.dtype == np.float32
+    assert binned.tolist() == [[2.5, 4.5], [10.5, 12.5]]
+
+
+def test_median_bin_keeps_integer_dtype():
+    data = np.array([[1, 100, 5, 5], [2, 3, 5, 5]], dtype=np.uint16)
+    binned = preview.block_bin(data, 2, 'median')
+    assert binned.dtype == np.uint16
+    assert binned.tolist() == [[2, 5]]
+
+
+def test_edges_that_do_not_fill_a_block_are_dropped():
+    assert preview.block_bin(np.zeros((7, 10), dtype=np.uint16), 3).shape == (2, 3)
+
+
+def test_factor_one_returns_input():
+    data = np.zeros((4, 4), dtype=np.uint16)
+    assert preview.block_bin(data, 1) is data
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        preview.block_bin(np.zeros((4, 4)), 2, 'max')
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import stretch
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int16])
+def test_integer_limits_match_percentile(dtype):
+    info = np.iinfo(dtype)
+    rng = np.random.default_rng(0)
+    data = rng.integers(info.min, info.max, size=(300, 400), endpoint=True).astype(dtype)
+    low, high = stretch.compute_stretch_limits(data)
+    expected = np.percentile(data, [100 * stretch.CLIP_LOW, 100 * stretch.CLIP_HIGH], method='inverted_cdf')
+    assert (low, high) == tuple(float(value) for value in expected)
+
+
+def test_float_limits_are_within_one_bin_of_percentile():
+    rng = np.random.default_rng(1)
+    data = rng.normal(1000, 50, size=(300, 400)).astype(np.float32)
+    low, high = stretch.compute_stretch_limits(data)
+    expected_low, expected_high = np.percentile(data, [100 * stretch.CLIP_LOW, 100 * stretch.CLIP_HIGH], method='inverted_cdf')
+    bin_width = (data.max() - data.min()) / stretch.FLOAT_BINS
+    assert abs(low - expected_low) <= bin_width
+    assert abs(high - expected_high) <= bin_width
+
+
+def test_float_limits_ignore_non_finite_pixels():
+    data = np.linspace(0, 1, 10000, dtype=np.float32).reshape(100, 100)
+    data[0, :10] = np.nan
+    data[1, :10] = np.inf
+    low, high = stretch.compute_stretch_limits(data, 0, 1)
+    assert 0 <= low < high <= 1
+
+
+def test_sampled_limits_are_close_to_exact():
+    rng = np.random.default_rng(2)
+    data = rng.normal(2000, 100, size=(1000, 1000)).astype(np.uint16)
+    exact = stretch.compute_stretch_limits(data)
+    sampled = stretch.compute_stretch_limits(data, sample_size=100_000)
+    assert sampled == pytest.approx(exact, abs=10)
+
+
+def test_stratified_sample_size():
+    data = np.zeros((1000, 2000))
+    assert stretch.stratified_sample(data, None) is data
+    assert stretch.stratified_sample(data, 10 ** 7) is data
+    assert stretch.stratified_sample(data, 20_000).size == pytest.approx(20_000, rel=0.1)
+
+
+def test_apply_stretch_maps_limits_to_full_range():
+    data = np.array([[0, 100, 150, 200, 300]], dtype=np.uint16)
+    assert stretch.apply_stretch(data, 100, 200).tolist() == [[0, 0, 127, 255, 255]]
+    assert stretch.apply_stretch(data, 100, 100).tolist() == [[0, 0, 0, 0, 0]]
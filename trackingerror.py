@@ -1,24 +1,235 @@
 import os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from astropy.io import fits
+import fitsreader
+import preview
+import previewcache
+import stretch
 from astropy.stats import sigma_clipped_stats
-from photutils import DAOStarFinder
+from photutils.detection import DAOStarFinder
 from nicegui import ui
 from scipy.spatial import cKDTree
 
 # Directory containing the FITS files
 fits_dir = '/Users/adampaul/Local Documents/Astrophotography/M106/Good Frames'
 
-def find_stars(fits_file):
-    """Detect stars in a FITS image."""
-    with fits.open(fits_file) as hdul:
-        data = hdul[0].data
-        mean, median, std = sigma_clipped_stats(data)
-        daofind = DAOStarFinder(fwhm=3.0, threshold=5.*std)
-        stars = daofind(data - median)
-        if stars is not None:
-            return stars['xcentroid'], stars['ycentroid']
+DETECTION_FWHM = 3.0
+# Detection threshold in units of the background standard deviation
+DETECTION_SIGMA = 5.0
+# Tiled detection: tile size, and how far each tile is read past its edges so stars on a border are seen whole
+TILE_SIZE = 1024
+TILE_OVERLAP = 16
+# Pixels sampled (on a regular grid) to estimate the sky background and noise
+BACKGROUND_SAMPLE_SIZE = 1_000_000
+# Phase correlation drift: frames are binned by this factor and a central patch of this size (binned pixels) is used
+DRIFT_BIN_FACTOR = 4
+DRIFT_PATCH_SIZE = 1024
+# Drift estimation methods for compute_differences and the drift monitor
+DRIFT_METHODS = ('stars', 'phase')
+# Star catalogs (x, y, flux, fwhm, eccentricity per star, plus the frame background) are cached here, keyed by file and detection settings
+CATALOG_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "observatory-control-panel", "stars")
+# Half size of the box around each star used to measure its shape
+SHAPE_RADIUS = 5
+
+def star_centroids(stars):
+    # photutils renamed xcentroid/ycentroid to x_centroid/y_centroid in 2.0
+    if 'xcentroid' in stars.colnames:
+        return np.asarray(stars['xcentroid']), np.asarray(stars['ycentroid'])
+    return np.asarray(stars['x_centroid']), np.asarray(stars['y_centroid'])
+
+def region_origin(region):
+    """(row, column) of the top left corner of region in the full frame."""
+    if region is None:
+        return 0, 0
+    return region[0].start or 0, region[1].start or 0
+
+def find_stars(fits_file, region=None, tiled=False, workers=None, use_processes=False):
+    """Detect stars in a FITS image, optionally only within region, a (rows, columns) tuple of slices.
+
+    tiled=True uses find_stars_tiled, which is much faster on large frames.
+    Centroids are returned as (x, y) arrays in full frame coordinates.
+    """
+    if tiled:
+        x, y, _ = find_stars_tiled(fits_file, region, workers=workers, use_processes=use_processes)
+        return x, y
+    data = fitsreader.read_fits_data(fits_file, region=region)
+    mean, median, std = sigma_clipped_stats(data)
+    daofind = DAOStarFinder(fwhm=DETECTION_FWHM, threshold=DETECTION_SIGMA*std)
+    stars = daofind(data - median)
+    if stars is not None:
+        # Report centroids in full frame coordinates
+        y_offset, x_offset = region_origin(region)
+        x, y = star_centroids(stars)
+        return x + x_offset, y + y_offset
+    return np.array([]), np.array([])
+
+def estimate_background(data, sample_size=BACKGROUND_SAMPLE_SIZE):
+    """Sky median and standard deviation, sigma clipped over a strided subsample instead of the whole frame."""
+    _, median, std = sigma_clipped_stats(stretch.stratified_sample(data, sample_size))
+    return median, std
+
+def tile_bounds(shape, tile_size=TILE_SIZE):
+    """(row start, row end, column start, column end) of non-overlapping tiles covering an image of shape."""
+    rows, columns = shape[-2:]
+    return [(r, min(r + tile_size, rows), c, min(c + tile_size, columns))
+            for r in range(0, rows, tile_size) for c in range(0, columns, tile_size)]
+
+def padded_region(bounds, shape, overlap=TILE_OVERLAP):
+    """Slices of a tile extended by overlap on every side, clipped to the image."""
+    r0, r1, c0, c1 = bounds
+    return (slice(max(0, r0 - overlap), min(shape[-2], r1 + overlap)),
+            slice(max(0, c0 - overlap), min(shape[-1], c1 + overlap)))
+
+def detect_in_tile(tile, origin, bounds, median, std):
+    """Detect stars in tile (an image whose top left pixel is at origin) and keep those centred inside bounds.
+
+    Every centroid belongs to exactly one tile's bounds, so overlapping tiles
+    don't report the same star twice. Returns (x, y, flux) arrays.
+    """
+    tile = tile.astype(np.float32)
+    tile -= median
+    stars = DAOStarFinder(fwhm=DETECTION_FWHM, threshold=DETECTION_SIGMA*std)(tile)
+    if stars is None:
+        return np.empty((3, 0))
+    x, y = star_centroids(stars)
+    x = x + origin[1]
+    y = y + origin[0]
+    # Pixel i covers coordinates i - 0.5 to i + 0.5
+    r0, r1, c0, c1 = bounds
+    inside = (y >= r0 - 0.5) & (y < r1 - 0.5) & (x >= c0 - 0.5) & (x < c1 - 0.5)
+    return np.vstack((x[inside], y[inside], np.asarray(stars['flux'])[inside]))
+
+def detect_in_file_tile(fits_file, frame_origin, bounds, shape, median, std):
+    """Process pool worker: read just one padded tile from the memory-mapped file and detect stars in it."""
+    rows, columns = padded_region(bounds, shape)
+    region = (slice(rows.start + frame_origin[0], rows.stop + frame_origin[0]),
+              slice(columns.start + frame_origin[1], columns.stop + frame_origin[1]))
+    tile = fitsreader.read_fits_data(fits_file, region=region, report=False)
+    return detect_in_tile(tile, (rows.start, columns.start), bounds, median, std)
+
+def merge_detections(x, y, flux, radius=DETECTION_FWHM / 2):
+    """Drop the fainter of any two detections closer than radius, e.g. a star split across a tile border."""
+    if x.size < 2:
+        return x, y, flux
+    pairs = cKDTree(np.column_stack((x, y))).query_pairs(radius, output_type='ndarray')
+    keep = np.ones(x.size, dtype=bool)
+    if len(pairs):
+        first, second = pairs[:, 0], pairs[:, 1]
+        keep[np.where(flux[first] < flux[second], first, second)] = False
+    return x[keep], y[keep], flux[keep]
+
+def find_stars_tiled(fits_file, region=None, workers=None, use_processes=False):
+    """Detect stars tile by tile across worker threads (or processes), returns (x, y, flux) in full frame coordinates.
+
+    The background is estimated once from a strided subsample, then each tile
+    is detected on its own small float copy instead of a full-frame
+    data - median array. With use_processes the workers read their own tiles
+    from the memory-mapped file, so no pixel data is pickled.
+    """
+    origin = region_origin(region)
+    if use_processes:
+        header = fits.getheader(fits_file)
+        rows, columns = region if region is not None else (slice(None), slice(None))
+        shape = (len(range(*rows.indices(header['NAXIS2']))), len(range(*columns.indices(header['NAXIS1']))))
+        step = max(1, int(np.sqrt(shape[0] * shape[1] / BACKGROUND_SAMPLE_SIZE)))
+        median, std = estimate_background(fitsreader.read_fits_data(fits_file, step=step, region=region))
+        tiles = tile_bounds(shape)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(detect_in_file_tile, *zip(*[(fits_file, origin, bounds, shape, median, std) for bounds in tiles])))
+        x, y, flux = merge_detections(*(np.hstack(results) if results else np.empty((3, 0))))
+    else:
+        data = fitsreader.read_fits_data(fits_file, region=region)
+        median, std = estimate_background(data)
+        x, y, flux = detect_stars(data, median, std, workers)
+    return x + origin[1], y + origin[0], flux
+
+def detect_stars(data, median, std, workers=None):
+    """Tiled detection on an image already in memory, tiles run across worker threads. Returns merged (x, y, flux)."""
+    def detect(bounds):
+        rows, columns = padded_region(bounds, data.shape)
+        return detect_in_tile(data[rows, columns], (rows.start, columns.start), bounds, median, std)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(detect, tile_bounds(data.shape)))
+    return merge_detections(*(np.hstack(results) if results else np.empty((3, 0))))
+
+def star_shapes(data, x, y, std, radius=SHAPE_RADIUS):
+    """FWHM and eccentricity of each star from the second moments of the background subtracted pixels around it.
+
+    The background is the median of each box's border, which follows sky
+    gradients, and pixels less than 2 sigma above it are ignored so noise in
+    the box doesn't inflate the moments.
+    """
+    if x.size == 0:
         return np.array([]), np.array([])
+    offsets = np.arange(-radius, radius + 1)
+    rows = np.clip(np.round(y).astype(int)[:, None, None] + offsets[None, :, None], 0, data.shape[0] - 1)
+    columns = np.clip(np.round(x).astype(int)[:, None, None] + offsets[None, None, :], 0, data.shape[1] - 1)
+    boxes = data[rows, columns].astype(np.float32)
+    border = np.concatenate((boxes[:, [0, -1], :].reshape(len(boxes), -1), boxes[:, 1:-1, [0, -1]].reshape(len(boxes), -1)), axis=1)
+    weights = boxes - np.median(border, axis=1)[:, None, None]
+    weights[weights < 2 * std] = 0
+    total = np.maximum(weights.sum(axis=(1, 2)), 1e-12)
+    dy = rows - y[:, None, None]
+    dx = columns - x[:, None, None]
+    xx = (weights * dx * dx).sum(axis=(1, 2)) / total
+    yy = (weights * dy * dy).sum(axis=(1, 2)) / total
+    xy = (weights * dx * dy).sum(axis=(1, 2)) / total
+    # Eigenvalues of the moment matrix are the variances along the major and minor axes
+    spread = np.sqrt(((xx - yy) / 2) ** 2 + xy ** 2)
+    major = np.maximum((xx + yy) / 2 + spread, 1e-12)
+    minor = np.maximum((xx + yy) / 2 - spread, 0)
+    fwhm = 2.3548 * np.sqrt((major + minor) / 2)
+    eccentricity = np.sqrt(1 - minor / major)
+    return fwhm, eccentricity
+
+def star_catalog(fits_file, workers=None):
+    """(5, n) array of x, y, flux, FWHM and eccentricity for every star detected in a frame, and the frame's (median, std) background."""
+    data = fitsreader.read_fits_data(fits_file)
+    median, std = estimate_background(data)
+    x, y, flux = detect_stars(data, median, std, workers)
+    fwhm, eccentricity = star_shapes(data, x, y, std)
+    return np.vstack((x, y, flux, fwhm, eccentricity)), np.array([median, std])
+
+def catalog_path(fits_file, cache_dir=CATALOG_CACHE_DIR):
+    key = previewcache.PreviewCache.make_key(fits_file, fwhm=DETECTION_FWHM, sigma=DETECTION_SIGMA, tile=TILE_SIZE, overlap=TILE_OVERLAP, radius=SHAPE_RADIUS)
+    return os.path.join(cache_dir, key + ".npz")
+
+def load_cached_catalog(fits_file, cache_dir=CATALOG_CACHE_DIR):
+    """The cached (catalog, background) for the file as it is now (path, mtime, size and detection settings), or None."""
+    try:
+        with np.load(catalog_path(fits_file, cache_dir)) as cached:
+            return cached['catalog'], cached['background']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def cached_star_catalog_with_background(fits_file, cache_dir=CATALOG_CACHE_DIR, workers=None):
+    """star_catalog, computed once per version of a file and kept on disk."""
+    cached = load_cached_catalog(fits_file, cache_dir)
+    if cached is not None:
+        return cached
+    path = catalog_path(fits_file, cache_dir)
+    catalog, background = star_catalog(fits_file, workers)
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        np.savez(file, catalog=catalog, background=background)
+    os.replace(temporary_path, path)
+    return catalog, background
+
+def cached_star_catalog(fits_file, cache_dir=CATALOG_CACHE_DIR):
+    """Just the catalog from cached_star_catalog_with_background."""
+    return cached_star_catalog_with_background(fits_file, cache_dir)[0]
+
+def catalog_shift(reference, catalog):
+    """Mean (dx, dy) of the stars in catalog relative to the matching stars in reference, or None without matches."""
+    if reference.shape[1] == 0 or catalog.shape[1] == 0:
+        return None
+    matched_reference, matched = match_stars(reference[:2].T, catalog[:2].T)
+    if len(matched) == 0:
+        return None
+    difference = (matched - matched_reference).mean(axis=0)
+    return float(difference[0]), float(difference[1])
 
 def match_stars(positions1, positions2):
     """Match stars from two different images based on their positions."""
@@ -28,17 +239,86 @@ def match_stars(positions1, positions2):
     
     # Filter out matches with large distances if necessary
     max_distance = 5  # pixels, adjust as needed
-    match_indices = indices[dists < max_distance]
-    matched_positions1 = positions1[match_indices]
-    matched_positions2 = positions2
+    matched = dists < max_distance
+    matched_positions1 = positions1[indices[matched]]
+    matched_positions2 = positions2[matched]
 
     return matched_positions1, matched_positions2
 
-def compute_differences():
-    """Compute differences in star positions between consecutive images."""
+def drift_patch(fits_file, bin_factor=DRIFT_BIN_FACTOR, patch_size=DRIFT_PATCH_SIZE):
+    """Binned, background subtracted and Hann windowed central patch of a frame, ready for phase_correlate.
+
+    Only the central patch_size * bin_factor pixels square is read from the
+    memory-mapped file.
+    """
+    header = fits.getheader(fits_file)
+    rows = min(header['NAXIS2'], patch_size * bin_factor) // bin_factor * bin_factor
+    columns = min(header['NAXIS1'], patch_size * bin_factor) // bin_factor * bin_factor
+    top = (header['NAXIS2'] - rows) // 2
+    left = (header['NAXIS1'] - columns) // 2
+    data = fitsreader.read_fits_data(fits_file, region=(slice(top, top + rows), slice(left, left + columns)))
+    patch = preview.block_bin(data, bin_factor).astype(np.float32)
+    patch -= np.median(patch)
+    # Taper the edges so the patch border doesn't dominate the correlation
+    patch *= np.outer(np.hanning(patch.shape[0]), np.hanning(patch.shape[1])).astype(np.float32)
+    return patch
+
+def phase_correlate(reference, patch):
+    """Sub-pixel (dx, dy) by which patch is shifted relative to reference, in (binned) pixels.
+
+    The normalised cross-power spectrum of the two patches is transformed back
+    to a single correlation peak at the shift; a parabola through the peak and
+    its neighbours gives the sub-pixel position.
+    """
+    cross_power = np.fft.rfft2(patch) * np.conj(np.fft.rfft2(reference))
+    cross_power /= np.maximum(np.abs(cross_power), 1e-12)
+    correlation = np.fft.irfft2(cross_power, s=reference.shape)
+    peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+
+    shift = []
+    for axis, size in enumerate(correlation.shape):
+        before = list(peak)
+        after = list(peak)
+        before[axis] = (peak[axis] - 1) % size
+        after[axis] = (peak[axis] + 1) % size
+        low, centre, high = correlation[tuple(before)], correlation[peak], correlation[tuple(after)]
+        # Closed form for the sinc-shaped peak of a shifted impulse (Foroosh et al. 2002), using the larger neighbour
+        if high >= low:
+            offset = high / (high + centre) if high + centre != 0 else 0.0
+        else:
+            offset = -low / (low + centre) if low + centre != 0 else 0.0
+        position = peak[axis] + offset
+        # Peaks past the middle are negative shifts wrapped around
+        shift.append(position - size if position > size / 2 else position)
+    dy, dx = shift
+    return dx, dy
+
+def phase_differences(files, bin_factor=DRIFT_BIN_FACTOR):
+    """Frame to frame (dx, dy) drift in full resolution pixels by phase correlation, no star detection needed."""
+    differences = []
+    previous = None
+    for file in files:
+        patch = drift_patch(file, bin_factor)
+        if previous is not None and previous.shape == patch.shape:
+            dx, dy = phase_correlate(previous, patch)
+            differences.append((dx * bin_factor, dy * bin_factor))
+        previous = patch
+    return differences
+
+def compute_differences(method='stars'):
+    """Compute differences in star positions between consecutive images.
+
+    method is 'stars' to detect and match stars, or 'phase' for FFT phase
+    correlation, which is much faster and works on frames with few stars.
+    """
+    if method not in DRIFT_METHODS:
+        raise ValueError(f"unknown drift method {method}")
     files = sorted([os.path.join(fits_dir, f) for f in os.listdir(fits_dir) if f.endswith('.fits')], key=os.path.getmtime, reverse=True)[:10]
     files = sorted(files)  # Optional: Sort the selected files by name if needed
 
+    if method == 'phase':
+        return phase_differences(files)
+
     positions = [find_stars(file) for file in files]
     
     differences = []
@@ -57,9 +337,9 @@ def compute_differences():
 
     return differences
 
-def plot_differences():
+def plot_differences(method='stars'):
     """Plot the differences on a NiceGUI graph."""
-    diffs = compute_differences()
+    diffs = compute_differences(method)
     x_diffs = [diff[0] for diff in diffs]
     y_diffs = [diff[1] for diff in diffs]
     
@@ -70,5 +350,8 @@ def plot_differences():
         plot.ylabel('Position Difference (pixels)')
         plot.legend()
 
-ui.button('Plot Star Position Differences', on_click=plot_differences)
-ui.run()
\ No newline at end of file
+# Only run the standalone page when executed as a script, so worker processes can import this module
+if __name__ in {"__main__", "__mp_main__"}:
+    method = ui.toggle({'stars': 'Star matching', 'phase': 'Phase correlation'}, value='stars')
+    ui.button('Plot Star Position Differences', on_click=lambda: plot_differences(method.value))
+    ui.run()
@@ -1,6 +1,8 @@
 from nicegui import Client, app, core, run, ui
 import time
+import asyncio
 from fastapi import Response
+from fastapi.responses import StreamingResponse
 import base64
 import cv2
 import numpy as np
@@ -9,10 +11,37 @@ from fastapi_utils.tasks import repeat_every
 import struct
 from dataclasses import dataclass
 import yaml
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 from pathlib import Path
 
+# Multipart boundary for the MJPEG stream
+STREAM_BOUNDARY = b"frame"
+# Reconnect backoff when the RTSP stream can't be opened or drops, in seconds
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# A camera counts as watched for this long after the last snapshot request
+WATCH_TIMEOUT = 5
+# Weight of the newest sample in the FPS/latency moving averages
+METRICS_SMOOTHING = 0.1
+
 class VideoManager:
+    """Captures frames from an RTSP camera and serves them as JPEG snapshots or an MJPEG stream.
+
+    Each frame is JPEG encoded at most once, however many clients are
+    watching, and the encoded bytes are shared. Stream clients always get the
+    newest frame when they are ready to send, so a slow client skips frames
+    instead of queuing them.
+
+    The capture thread blocks on the camera instead of polling, reconnects
+    with backoff when the stream drops, and bumps a generation counter under a
+    condition variable so consumers only wake for new frames. While nobody is
+    watching it keeps draining the stream but only converts a frame every
+    idle_interval seconds, at idle_scale resolution. Backends that can change
+    the capture size (V4L2 and most webcams) are asked for the smaller frames,
+    so decoding gets cheaper too. An RTSP stream through FFmpeg can't change
+    size, so its frames are decoded in full and downscaled, which only saves
+    encoding and memory.
+    """
     # In case you don't have a webcam, this will provide a black placeholder image.
     black_1px = 'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAAXNSR0IArs4c6QAAAA1JREFUGFdjYGBg+A8AAQQBAHAgZQsAAAAASUVORK5CYII='
     placeholder = Response(content=base64.b64decode(black_1px.encode('ascii')), media_type='image/png')
@@ -22,53 +51,239 @@ class VideoManager:
         _, imencode_image = cv2.imencode('.jpg', frame)
         return imencode_image.tobytes()
 
-    def __init__(self, credential_file: str):
+    def __init__(self, credential_file: str, idle_scale=0.5, idle_interval=1.0):
         with open(credential_file, 'r') as file:
             credentials = yaml.safe_load(file)
         # Access the username and password
         username = credentials['username']
         password = credentials['password']
         ip = credentials['ip']
-        self.video_capture = cv2.VideoCapture(f"rtsp://{username}:{password}@{ip}/stream2")
-        self.video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.url = f"rtsp://{username}:{password}@{ip}/stream2"
+        self.video_capture = None
+        self.idle_scale = idle_scale
+        self.idle_interval = idle_interval
+        self.full_size = None  # (width, height) the capture opened at
+        self.capture_watched = True  # whether the capture size was last set for watched or idle mode
+        self.capture_scaled = False  # the capture itself is delivering idle_scale frames
         # Initialize variables to hold the latest frame and a lock for thread-safe operations
         self.latest_frame = None
+        self.generation = 0  # incremented for every captured frame
+        self.frame_time = None
         self.lock = Lock()
+        self.new_frame = Condition(self.lock)
+        # Latest JPEG and the frame it was encoded from, shared by every client
+        self.jpeg = None
+        self.jpeg_generation = -1
+        self.encode_lock = Lock()
+        # MJPEG stream clients, woken on the event loop when a new frame is encoded
+        self.viewers = 0
+        self.last_request = 0
+        self.loop = None
+        self.frame_ready = asyncio.Event()
+        # Metrics
+        self.fps = 0.0
+        self.read_latency = 0.0  # seconds spent in read()/grab() per frame
+        self.encode_latency = 0.0
+        self.frames_decoded = 0
+        self.frames_skipped = 0
+        self.reconnects = 0
+        self.last_frame_at = None
+        self.ip = ip
+        self.running = False
+        self.reader = None
 
-        # Start the background frame reading task
-        self.read_frames_continuously()
+    def start(self):
+        """Start the background frame reading thread."""
+        if self.reader is not None:
+            return
+        self.running = True
+        self.reader = Thread(target=self.read_loop, daemon=True, name=f"video capture {self.ip}")
+        self.reader.start()
 
-    def read_frames_continuously(self):
-        """Read frames in a separate thread and update the latest frame."""
-        def read_loop():
-            while True:
-                time.sleep(0.01)
-                if self.video_capture.isOpened():
-                    success, frame = self.video_capture.read()
-                    if success:
-                        with self.lock:
-                            self.latest_frame = frame
-        # Start the thread
-        Thread(target=read_loop, daemon=True).start()
+    def stop(self):
+        self.running = False
+        if self.reader is not None:
+            self.reader.join(timeout=5)
+            self.reader = None
+        self.close_capture()
+
+    def open_capture(self):
+        video_capture = cv2.VideoCapture(self.url)
+        if not video_capture.isOpened():
+            video_capture.release()
+            raise ConnectionError(f"unable to open {self.url.split('@')[-1]}")
+        video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.full_size = (int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.capture_watched = True
+        self.capture_scaled = False
+        self.video_capture = video_capture
+
+    def set_capture_scale(self, scale):
+        """Ask the capture for frames at scale times the full size, return whether it now delivers that size."""
+        if self.full_size is None or 0 in self.full_size:
+            return False
+        width, height = (max(1, int(size * scale)) for size in self.full_size)
+        self.video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # Backends that can't change size ignore set() or report success anyway, so check what they report now
+        return (int(self.video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))) == (width, height)
+
+    def close_capture(self):
+        video_capture, self.video_capture = self.video_capture, None
+        if video_capture is not None:
+            video_capture.release()
+
+    def is_watched(self):
+        return self.viewers > 0 or time.time() - self.last_request < WATCH_TIMEOUT
+
+    def read_loop(self):
+        """Capture thread: read() blocks until the camera delivers a frame, so there is no sleep-polling."""
+        delay = RECONNECT_MIN_DELAY
+        last_decode = 0
+        while self.running:
+            if self.video_capture is None:
+                try:
+                    self.open_capture()
+                except Exception as e:
+                    print(f"{e}, retrying in {delay}s")
+                    time.sleep(delay)
+                    delay = min(2 * delay, RECONNECT_MAX_DELAY)
+                    continue
+
+            watched = self.is_watched()
+            if self.idle_scale != 1 and watched != self.capture_watched:
+                # Switch the capture size on entering or leaving idle mode, where the backend supports it
+                self.capture_watched = watched
+                if not watched:
+                    self.capture_scaled = self.set_capture_scale(self.idle_scale)
+                elif self.capture_scaled:
+                    self.set_capture_scale(1)
+                    self.capture_scaled = False
+            start = time.monotonic()
+            if watched or start - last_decode >= self.idle_interval:
+                success, frame = self.video_capture.read()
+                last_decode = start
+            else:
+                # Keep the RTSP buffer drained without converting the frame
+                success, frame = self.video_capture.grab(), None
+            now = time.monotonic()
+            if not success:
+                print(f"video stream dropped, reconnecting in {delay}s")
+                self.close_capture()
+                self.reconnects += 1
+                self.last_frame_at = None
+                # Back off here too, a stream that opens but never delivers would otherwise spin
+                time.sleep(delay)
+                delay = min(2 * delay, RECONNECT_MAX_DELAY)
+                continue
+
+            delay = RECONNECT_MIN_DELAY
+            self.read_latency += METRICS_SMOOTHING * (now - start - self.read_latency)
+            if self.last_frame_at is not None and now > self.last_frame_at:
+                self.fps += METRICS_SMOOTHING * (1 / (now - self.last_frame_at) - self.fps)
+            self.last_frame_at = now
+            if frame is None:
+                self.frames_skipped += 1
+                continue
+            if not watched and self.idle_scale != 1 and not self.capture_scaled:
+                frame = cv2.resize(frame, None, fx=self.idle_scale, fy=self.idle_scale, interpolation=cv2.INTER_AREA)
+            self.publish(frame)
+
+    def publish(self, frame):
+        with self.new_frame:
+            self.latest_frame = frame
+            self.generation += 1
+            self.frame_time = time.time()
+            self.frames_decoded += 1
+            self.new_frame.notify_all()
+        if self.viewers and self.loop is not None:
+            # Encode once here for every stream client
+            self.latest_jpeg()
+            self.loop.call_soon_threadsafe(self.notify_viewers)
+
+    def wait_for_frame(self, after_generation, timeout=None):
+        """Block until a frame newer than after_generation arrives, returns (frame, generation).
+
+        On timeout the current (possibly unchanged) frame and generation are returned.
+        """
+        with self.new_frame:
+            self.new_frame.wait_for(lambda: self.generation > after_generation, timeout)
+            return self.latest_frame, self.generation
+
+    def metrics(self):
+        return dict(
+            connected=self.video_capture is not None,
+            watched=self.is_watched(),
+            viewers=self.viewers,
+            fps=round(self.fps, 2),
+            read_latency_ms=round(self.read_latency * 1000, 2),
+            encode_latency_ms=round(self.encode_latency * 1000, 2),
+            frame_age_s=None if self.frame_time is None else round(time.time() - self.frame_time, 3),
+            frames_decoded=self.frames_decoded,
+            frames_skipped=self.frames_skipped,
+            reconnects=self.reconnects,
+        )
+
+    def latest_jpeg(self):
+        """JPEG of the latest frame (None before the first frame), encoded at most once per frame."""
+        with self.encode_lock:
+            with self.lock:
+                frame, generation = self.latest_frame, self.generation
+            if frame is None:
+                return None
+            if self.jpeg_generation != generation:
+                start = time.monotonic()
+                self.jpeg = VideoManager.convert(frame)
+                self.jpeg_generation = generation
+                self.encode_latency += METRICS_SMOOTHING * (time.monotonic() - start - self.encode_latency)
+            return self.jpeg
+
+    def notify_viewers(self):
+        # Wake everyone waiting on the current event, later waiters get a fresh one
+        event, self.frame_ready = self.frame_ready, asyncio.Event()
+        event.set()
 
     async def grab_video_frame(self) -> Response:
-        with self.lock:
-            # Check if we have a frame available
-            if self.latest_frame is None:
-                return VideoManager.placeholder
-            frame = self.latest_frame
-
-        # Convert the frame (this operation is CPU-intensive and might be async executed)
-        jpeg = await run.cpu_bound(VideoManager.convert, frame)
+        self.last_request = time.time()
+        # cv2 releases the GIL while encoding, so a thread is enough and avoids pickling the frame to a process
+        jpeg = await run.io_bound(self.latest_jpeg)
+        if jpeg is None:
+            return VideoManager.placeholder
         return Response(content=jpeg, media_type='image/jpeg')
 
-# Dictionary to hold VideoManager instances
-yaml_file = Path(__file__).resolve().parent / "observatory_cam.yaml"
-video_managers = {
-    "observatory_cam": VideoManager(yaml_file),
-    #"cloud_cam": VideoManager("rtsp://your_second_camera_url"),
+    async def stream_frames(self):
+        """Multipart MJPEG body: one part per frame, the newest one whenever the client is ready."""
+        self.loop = asyncio.get_running_loop()
+        self.viewers += 1
+        try:
+            sent_id = None
+            while True:
+                jpeg, jpeg_id = self.jpeg, self.jpeg_generation
+                if jpeg is None or jpeg_id == sent_id:
+                    await self.frame_ready.wait()
+                    continue
+                sent_id = jpeg_id
+                yield (b"--" + STREAM_BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                       + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+        finally:
+            self.viewers -= 1
+
+# Camera id -> credentials file, cameras without one are left out
+camera_credentials = {
+    "observatory_cam": Path(__file__).resolve().parent / "observatory_cam.yaml",
+    #"cloud_cam": Path(__file__).resolve().parent / "cloud_cam.yaml",
     # Add more cameras as needed
 }
+# Dictionary to hold VideoManager instances
+video_managers = {}
+for camera_id, credential_file in camera_credentials.items():
+    if not credential_file.exists():
+        print(f"no credentials for {camera_id} at {credential_file}, camera disabled")
+        continue
+    video_managers[camera_id] = VideoManager(credential_file)
+for video_manager in video_managers.values():
+    app.on_startup(video_manager.start)
+    app.on_shutdown(video_manager.stop)
 
 @app.get('/video/frame/{camera_id}')
 # Thanks to FastAPI's `app.get`` it is easy to create a web route which always provides the latest image from OpenCV.
@@ -77,3 +292,16 @@ async def grab_video_frame(camera_id: str) -> Response:
     if not video_manager:
         return Response(content="Camera ID not found", status_code=404)
     return await video_manager.grab_video_frame()
+
+@app.get('/video/metrics')
+async def video_metrics():
+    """Capture FPS, latency and reconnect counts per camera."""
+    return {camera_id: video_manager.metrics() for camera_id, video_manager in video_managers.items()}
+
+@app.get('/video/stream/{camera_id}')
+async def stream_video(camera_id: str):
+    """MJPEG stream, usable directly as an <img> source."""
+    video_manager = video_managers.get(camera_id)
+    if not video_manager:
+        return Response(content="Camera ID not found", status_code=404)
+    return StreamingResponse(video_manager.stream_frames(), media_type=f"multipart/x-mixed-replace; boundary={STREAM_BOUNDARY.decode()}")